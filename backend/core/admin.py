@@ -18,4 +18,8 @@ class TransactionAdmin(admin.ModelAdmin):
 class BudgetAdmin(admin.ModelAdmin):
     list_display = ('category', 'amount', 'month', 'year', 'user', 'get_spent_amount', 'get_remaining_amount')
     list_filter = ('month', 'year', 'category')
-    search_fields = ('category__name',)
\ No newline at end of file
+    search_fields = ('category__name',)
+    
+    def get_queryset(self, request):
+        # Annotate spending so list_display doesn't aggregate per row
+        return super().get_queryset(request).with_spending().select_related('category', 'user')
\ No newline at end of file
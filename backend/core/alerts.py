@@ -0,0 +1,84 @@
+"""
+Budget threshold alerts.
+
+A budget lists its alert thresholds as percentages of its amount. Writes only
+check the budgets of the rollup buckets they touched, against the running
+total the bucket already holds, so a transaction costs one lookup whatever
+the month contains. Each threshold is recorded once per budget; editing the
+budget forgets the thresholds its spending no longer reaches, so they can
+fire again.
+"""
+from django.db.models import Q
+
+from .models import Budget, BudgetAlert
+
+
+def crossed(thresholds, spent, amount):
+    """The thresholds, in percent of amount, that spent has reached"""
+    if amount <= 0:
+        return []
+    return [threshold for threshold in thresholds if spent * 100 >= threshold * amount]
+
+
+def evaluate(budgets, reset=False):
+    """
+    Record the thresholds each budget of the queryset has newly reached.
+
+    With reset, alerts for thresholds the budget no longer reaches are
+    removed first. Returns the alerts created.
+    """
+    if not reset:
+        budgets = budgets.exclude(alert_thresholds=[])
+    rows = list(budgets.with_spending().values('id', 'user_id', 'alert_thresholds', 'amount', 'spent_total'))
+    if not rows:
+        return []
+
+    reached = {
+        row['id']: crossed(row['alert_thresholds'], row['spent_total'], row['amount'])
+        for row in rows
+    }
+    if reset:
+        # Budgets mostly share their thresholds, so this is one DELETE per distinct set
+        by_thresholds = {}
+        for budget_id, thresholds in reached.items():
+            by_thresholds.setdefault(tuple(thresholds), []).append(budget_id)
+        for thresholds, budget_ids in by_thresholds.items():
+            BudgetAlert.objects.filter(budget_id__in=budget_ids).exclude(threshold__in=thresholds).delete()
+
+    candidates = [row for row in rows if reached[row['id']]]
+    if not candidates:
+        return []
+    recorded = set(BudgetAlert.objects.filter(
+        budget_id__in=[row['id'] for row in candidates]
+    ).values_list('budget_id', 'threshold'))
+    alerts = [
+        BudgetAlert(
+            user_id=row['user_id'],
+            budget_id=row['id'],
+            threshold=threshold,
+            spent=row['spent_total'],
+            amount=row['amount']
+        )
+        for row in candidates
+        for threshold in reached[row['id']]
+        if (row['id'], threshold) not in recorded
+    ]
+    # A concurrent write may record the same crossing first
+    return BudgetAlert.objects.bulk_create(alerts, ignore_conflicts=True)
+
+
+def check_bucket(user_id, year, month, category_id):
+    """Check the budget of one expense rollup bucket after its total grew"""
+    if category_id is None:
+        return []
+    return evaluate(Budget.objects.filter(user_id=user_id, category_id=category_id, year=year, month=month))
+
+
+def check_months(user_id, months):
+    """Check every budget of a user in the given (year, month) pairs"""
+    if not months:
+        return []
+    in_months = Q()
+    for year, month in set(months):
+        in_months |= Q(year=year, month=month)
+    return evaluate(Budget.objects.filter(in_months, user_id=user_id))
@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Case, Count, DateField, DecimalField, F, Func, Sum, When, Window
+from django.db.models.functions import Trunc
+
+from . import fx
+from .models import Transaction
+
+GRANULARITY_STEPS = {
+    'day': relativedelta(days=1),
+    'week': relativedelta(weeks=1),
+    'month': relativedelta(months=1),
+    'year': relativedelta(years=1),
+}
+MAX_PERIODS = 5000
+
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+class WindowSum(Func):
+    """SUM usable over a window of already aggregated rows"""
+    function = 'SUM'
+    window_compatible = True
+
+
+class RunningTotal(Window):
+    """Window over a grouped query; its ordering columns are already grouped on"""
+
+    def get_group_by_cols(self):
+        return []
+
+
+def truncate(day, granularity):
+    """Return the first day of the period containing day, matching the SQL truncation"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def period_count(start_date, end_date, granularity):
+    """Return how many periods of the granularity the date range spans"""
+    start = truncate(start_date, granularity)
+    end = truncate(end_date, granularity)
+    if granularity == 'day':
+        return (end - start).days + 1
+    if granularity == 'week':
+        return (end - start).days // 7 + 1
+    if granularity == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return end.year - start.year + 1
+
+
+def period_rows(user, start_date, end_date, granularity):
+    """
+    Totals per period, type and category in one grouped query.
+
+    Each row also carries the net balance of every period up to and including
+    its own, computed by a window over the grouped rows.
+    """
+    # Every amount is converted to the base currency inside the aggregates
+    amount = fx.base_amount()
+    signed_amount = Case(
+        When(type='income', then=amount),
+        default=-amount,
+        output_field=AMOUNT_FIELD
+    )
+    return Transaction.objects.filter(
+        user=user,
+        date__gte=start_date,
+        date__lte=end_date
+    ).order_by().annotate(
+        period=Trunc('date', granularity, output_field=DateField())
+    ).values(
+        'period', 'type', 'category_id', 'category__name'
+    ).annotate(
+        total=Sum(amount),
+        count=Count('id'),
+        running_balance=RunningTotal(
+            WindowSum(Sum(signed_amount), output_field=AMOUNT_FIELD),
+            order_by=F('period').asc()
+        )
+    ).order_by('period', 'type', '-total')
+
+
+def build_analytics(user, start_date, end_date, granularity):
+    """Return one summary per period of the range, including periods without transactions"""
+    periods = {}
+    period = truncate(start_date, granularity)
+    while period <= end_date:
+        periods[period] = {
+            'period': period,
+            'total_income': 0,
+            'total_expense': 0,
+            'remaining_balance': 0,
+            'running_balance': None,
+            'income_by_category': [],
+            'expenses_by_category': [],
+        }
+        period += GRANULARITY_STEPS[granularity]
+
+    for row in period_rows(user, start_date, end_date, granularity):
+        # Some backends hand back datetimes from the truncation
+        key = row['period'].date() if hasattr(row['period'], 'date') else row['period']
+        summary = periods[key]
+        breakdown = {'category_id': row['category_id'], 'category': row['category__name'], 'amount': row['total']}
+        if row['type'] == 'income':
+            summary['total_income'] += row['total']
+            summary['income_by_category'].append(breakdown)
+        else:
+            summary['total_expense'] += row['total']
+            summary['expenses_by_category'].append(breakdown)
+        summary['running_balance'] = row['running_balance']
+
+    # Empty periods carry the balance forward
+    running_balance = 0
+    for summary in periods.values():
+        summary['remaining_balance'] = summary['total_income'] - summary['total_expense']
+        if summary['running_balance'] is None:
+            summary['running_balance'] = running_balance
+        running_balance = summary['running_balance']
+    return list(periods.values())
@@ -0,0 +1,177 @@
+"""
+Async versions of the read-heavy endpoints, for deployments served over ASGI.
+
+DRF views are synchronous, so these are plain Django async views that reuse
+DRF's authentication, serializers and JSON rendering. Their responses match
+the sync endpoints byte for byte. Independent queries run at the same time,
+each on its own database connection.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import reports
+from .cache import (
+    categories_scope, period_scope, response_headers, response_key, summary_scopes, user_scope
+)
+from .fastpath import BudgetValuesSerializer
+from .renderers import FastJSONRenderer
+from .routers import reading_from, replica_allowed
+from .serializers import MonthlySummarySerializer
+from .utils import month_range
+
+
+def json_response(data, status_code=status.HTTP_200_OK, headers=None):
+    """Render data exactly as the API's JSON renderer would"""
+    response = HttpResponse(
+        FastJSONRenderer().render(data),
+        status=status_code,
+        headers=headers,
+        content_type='application/json'
+    )
+    # Kept for the response cache, which stores data the way the sync views do
+    response.data = data
+    return response
+
+
+def _authenticate(request, authenticators):
+    user = Request(request, authenticators=authenticators).user
+    if not user or not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
+
+
+def authenticated(view):
+    """Authenticate an async view with the API's authentication classes, answering 401 on failure"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        try:
+            request.user = await sync_to_async(_authenticate)(request, authenticators)
+        except APIException as exc:
+            headers = {}
+            if authenticators:
+                headers['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+            return json_response({'detail': exc.detail}, status.HTTP_401_UNAUTHORIZED, headers)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def cached(name, scopes):
+    """
+    The async counterpart of core.cache.cache_response.
+
+    Given the name of the matching sync handler, it reads and writes the same
+    cache entries and answers with the same ETags.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag, key = await sync_to_async(response_key)(
+                name, request.user.id, request.META.get('QUERY_STRING', ''), scopes(request)
+            )
+            headers = response_headers(etag)
+
+            if etag in request.headers.get('If-None-Match', ''):
+                return HttpResponse(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            data = await cache.aget(key)
+            if data is None:
+                response = await view(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                data = response.data
+                await cache.aset(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+            return json_response(data, headers=headers)
+        return wrapper
+    return decorator
+
+
+def replica_reads(view):
+    """Serve an async read-only view from the replica, unless its user has just written"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Threads started inside the block inherit the routing through the context
+        with reading_from(await sync_to_async(replica_allowed)(request.user.id)):
+            return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _on_own_connection(function, *args):
+    try:
+        return function(*args)
+    finally:
+        # Pool threads outlive the request, so release the connection the way a request would
+        close_old_connections()
+
+
+async def gather_queries(*calls):
+    """
+    Run (function, *args) calls concurrently and return their results in order.
+
+    Each call runs on a pool thread, and so on that thread's own connection,
+    instead of queueing behind the others on the request's thread.
+    """
+    return await asyncio.gather(*[
+        sync_to_async(_on_own_connection, thread_sensitive=False)(*call) for call in calls
+    ])
+
+
+@authenticated
+@cached('monthly-summary', summary_scopes)
+@replica_reads
+async def monthly_summary(request):
+    # Get month and year from query params or use current month
+    month = request.GET.get('month')
+    year = request.GET.get('year')
+    if not month or not year:
+        today = timezone.now().date()
+        month = today.month
+        year = today.year
+
+    try:
+        month_range(month, year)
+    except ValueError:
+        return json_response({'detail': 'Invalid month or year.'}, status.HTTP_400_BAD_REQUEST)
+
+    summary = await sync_to_async(reports.monthly_summary)(request.user, month, year)
+    return json_response(MonthlySummarySerializer(summary).data)
+
+
+@authenticated
+@cached('dashboard', lambda request: [user_scope(request.user.id), categories_scope(None)])
+@replica_reads
+async def dashboard(request):
+    today = timezone.now().date()
+
+    # The three queries do not depend on each other
+    summary, transactions, budgets = await gather_queries(
+        (reports.monthly_summary, request.user, today.month, today.year),
+        (list, reports.recent_transactions(request.user)),
+        (list, reports.month_budgets(request.user, today.month, today.year)),
+    )
+    return json_response(reports.dashboard_data(summary, transactions, budgets))
+
+
+@authenticated
+@cached('budgets-current-month', lambda request: [
+    period_scope(request.user.id, timezone.now().year, timezone.now().month),
+    categories_scope(request.user.id),
+    categories_scope(None),
+])
+@replica_reads
+async def current_month_budgets(request):
+    today = timezone.now().date()
+    queryset = reports.month_budgets(request.user, today.month, today.year)
+    budgets = [row async for row in BudgetValuesSerializer.values(queryset)]
+    return json_response(BudgetValuesSerializer(budgets).data)
@@ -0,0 +1,103 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import KEY_PREFIX
+from .instrumentation import timed
+
+# Bound on the per-process copies, which are cheap to rebuild from the shared cache
+MAX_LOCAL_USERS = 10000
+
+# user id -> (monotonic expiry, record)
+_local_users = {}
+
+
+def _user_key(user_id):
+    return f'{KEY_PREFIX}:auth-user:{user_id}'
+
+
+def _user_record(user):
+    # Everything but the password hash, which stays in the database
+    fields = [field.attname for field in user._meta.concrete_fields if field.attname != 'password']
+    return {
+        'fields': fields,
+        'values': [getattr(user, field) for field in fields],
+        'password_hash': get_md5_hash_password(user.password),
+    }
+
+
+def user_record(user_id):
+    """
+    Return the cached authentication record of a user, or None when there is no such user.
+
+    Records live in the shared cache for AUTH_USER_CACHE_TIMEOUT seconds and in
+    this process for AUTH_USER_LOCAL_TTL seconds on top of that.
+    """
+    now = time.monotonic()
+    local = _local_users.get(user_id)
+    if local is not None and local[0] > now:
+        return local[1]
+
+    record = cache.get(_user_key(user_id))
+    if record is None:
+        user = get_user_model().objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None:
+            return None
+        record = _user_record(user)
+        cache.set(_user_key(user_id), record, settings.AUTH_USER_CACHE_TIMEOUT)
+
+    if settings.AUTH_USER_LOCAL_TTL:
+        if len(_local_users) >= MAX_LOCAL_USERS:
+            _local_users.clear()
+        _local_users[user_id] = (now + settings.AUTH_USER_LOCAL_TTL, record)
+    return record
+
+
+def forget_user(user_id):
+    """Drop a user's cached record, so the next request reads the database again"""
+    cache.delete(_user_key(user_id))
+    _local_users.pop(user_id, None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from a cache instead of the database.
+
+    The user is rebuilt from the cached record with the password hash left
+    deferred, so it behaves like a user loaded from the database. Saving or
+    deleting a user drops the record. Password changes are caught by the
+    token's password hash claim (CHECK_REVOKE_TOKEN), and deactivation by the
+    cached is_active flag.
+    """
+
+    def authenticate(self, request):
+        with timed('auth'):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        record = user_record(user_id)
+        if record is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        user = self.user_model.from_db(router.db_for_read(self.user_model), record['fields'], record['values'])
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != record['password_hash']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+
+        return user
@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .categories import default_categories
+from .models import Category, Transaction
+from .serializers import TransactionBatchItemSerializer
+from .signals import deferred_rollups, transactions_changed
+
+MAX_BATCH_ITEMS = 1000
+
+
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class TransactionBatchSerializer(serializers.Serializer):
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate(self, attrs):
+        if sum(len(items) for items in attrs.values()) > MAX_BATCH_ITEMS:
+            raise serializers.ValidationError(f'A batch may contain at most {MAX_BATCH_ITEMS} items.')
+        return attrs
+
+
+class TransactionBatch:
+    """
+    Apply a batch of creates, partial updates and deletes to a user's transactions.
+
+    Ownership and categories for the whole batch are checked with one query each,
+    and nothing is written unless every item is valid.
+    """
+
+    def __init__(self, user, create, update, delete):
+        self.user = user
+        self.create_items = create
+        self.update_items = update
+        self.delete_ids = delete
+        self.errors = None
+
+    def load(self):
+        update_ids = [_as_int(item.get('id')) for item in self.update_items]
+        self.owned = Transaction.objects.select_related('category').filter(
+            user=self.user,
+            id__in=[pk for pk in update_ids + self.delete_ids if pk is not None]
+        ).in_bulk()
+
+        category_ids = {
+            _as_int(item.get('category')) for item in self.create_items + self.update_items
+        } - {None}
+        self.categories = {
+            category.id: category for category in default_categories() if category.id in category_ids
+        }
+        self.categories.update(Category.objects.filter(user=self.user, id__in=category_ids).in_bulk())
+
+    def is_valid(self):
+        self.load()
+        context = {'categories': self.categories}
+        errors = {'create': [], 'update': [], 'delete': []}
+
+        self.creates = []
+        for item in self.create_items:
+            serializer = TransactionBatchItemSerializer(data=item, context=context)
+            if serializer.is_valid():
+                self.creates.append(serializer.validated_data)
+            errors['create'].append(serializer.errors)
+
+        self.updates = []
+        for item in self.update_items:
+            instance = self.owned.get(_as_int(item.get('id')))
+            if instance is None:
+                errors['update'].append({'id': ['Not found.']})
+                continue
+            serializer = TransactionBatchItemSerializer(instance, data=item, partial=True, context=context)
+            if serializer.is_valid():
+                self.updates.append((instance, serializer.validated_data))
+            errors['update'].append(serializer.errors)
+
+        for pk in self.delete_ids:
+            errors['delete'].append({} if pk in self.owned else {'id': ['Not found.']})
+
+        if any(any(item_errors) for item_errors in errors.values()):
+            self.errors = errors
+            return False
+        return True
+
+    @transaction.atomic
+    def save(self):
+        months = set()
+        now = timezone.now()
+
+        created = [
+            Transaction(user=self.user, category=self.categories.get(data.get('category_id')), **{
+                field: value for field, value in data.items() if field != 'category_id'
+            })
+            for data in self.creates
+        ]
+        Transaction.objects.bulk_create(created)
+        months.update((row.date.year, row.date.month) for row in created)
+
+        updated = []
+        fields = {'updated_at'}
+        for instance, data in self.updates:
+            months.add((instance.date.year, instance.date.month))
+            for field, value in data.items():
+                if field == 'category_id':
+                    instance.category = self.categories.get(value)
+                    fields.add('category')
+                else:
+                    setattr(instance, field, value)
+                    fields.add(field)
+            instance.updated_at = now
+            months.add((instance.date.year, instance.date.month))
+            updated.append(instance)
+        if updated:
+            Transaction.objects.bulk_update(updated, fields=sorted(fields))
+
+        deleted = [self.owned[pk] for pk in self.delete_ids]
+        months.update((row.date.year, row.date.month) for row in deleted)
+        with deferred_rollups():
+            Transaction.objects.filter(user=self.user, id__in=self.delete_ids).delete()
+
+        if months:
+            transactions_changed.send(sender=Transaction, user_id=self.user.id, months=months)
+        return created, updated, list(self.delete_ids)
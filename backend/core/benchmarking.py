@@ -0,0 +1,225 @@
+"""
+Request timing for the benchmark commands.
+
+Every route of the API is described by a Route; run_route sends it through
+Django's test client, so requests pass the full middleware, authentication
+and serialization stack without a network hop, and records latency, status
+and the number of queries of each request.
+"""
+import statistics
+import time
+from itertools import count
+
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import Budget, BudgetAlert, Category, ExportJob, RecurringTransaction, Transaction
+
+# Accounts created by the registration route, removed again by cleanup()
+SIGNUP_PREFIX = 'bench_signup_'
+
+
+def percentile(samples, fraction):
+    """Return the sample below which the given fraction of the sorted samples fall"""
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+class Route:
+    """
+    One request to benchmark.
+
+    path and data may be callables taking the request number, for requests
+    that need a fresh token or a row of their own each time.
+    """
+
+    def __init__(self, name, path, method='get', data=None, authenticated=True, template=None):
+        self.name = name
+        self.path = path
+        self.template = path if isinstance(path, str) else template
+        self.method = method
+        self.data = data
+        self.authenticated = authenticated
+
+    def request_args(self, number):
+        path = self.path(number) if callable(self.path) else self.path
+        data = self.data(number) if callable(self.data) else self.data
+        return path, data
+
+    def describe(self):
+        return {'method': self.method.upper(), 'path': self.template}
+
+
+def routes(user, password):
+    """Return every route of core/urls.py and the token endpoints, with fixtures from the user's data"""
+    transaction = Transaction.objects.filter(user=user).order_by('-date', '-id').first()
+    category = Category.objects.filter(user=user, type='expense').order_by('id').first()
+    budget = Budget.objects.filter(user=user).first()
+    recurring = RecurringTransaction.objects.filter(user=user).order_by('id').first()
+    export_job = ExportJob.objects.filter(user=user).order_by('-id').first()
+    today = timezone.now().date()
+    names = count()
+
+    def new_transaction(number):
+        return {
+            'amount': '12.50',
+            'category': category.id,
+            'description': f'Benchmark {number}',
+            'date': today.isoformat(),
+            'type': 'expense',
+        }
+
+    def created_transaction_path(number):
+        created = Transaction.objects.create(user=user, **{**new_transaction(number), 'category': category})
+        return f'/api/transactions/{created.id}/'
+
+    def refresh_token(number):
+        return {'refresh': str(RefreshToken.for_user(user))}
+
+    result = [
+        Route('token-obtain', '/api/token/', 'post', {'username': user.username, 'password': password}, False),
+        Route('token-refresh', '/api/token/refresh/', 'post', refresh_token, False),
+        Route('token-blacklist', '/api/token/blacklist/', 'post', refresh_token, False),
+        Route('users-create', '/api/users/', 'post', lambda number: {
+            'username': f'{SIGNUP_PREFIX}{next(names)}_{time.monotonic_ns()}',
+            'email': 'signup@example.com',
+            'password': 'benchmark-signup',
+        }, False),
+        Route('users-list', '/api/users/'),
+        Route('users-detail', f'/api/users/{user.id}/'),
+        Route('categories-list', '/api/categories/'),
+        Route('categories-income', '/api/categories/income/'),
+        Route('categories-expense', '/api/categories/expense/'),
+        Route('categories-create', '/api/categories/', 'post', lambda number: {
+            'name': f'Benchmark {next(names)}_{time.monotonic_ns()}',
+            'type': 'expense',
+        }),
+        Route('transactions-list', '/api/transactions/'),
+        Route('transactions-list-filtered', f'/api/transactions/?type=expense&start_date={today.replace(day=1)}'),
+        Route('transactions-search', '/api/transactions/?search=groceries'),
+        Route('transactions-income', '/api/transactions/income/'),
+        Route('transactions-expense', '/api/transactions/expense/'),
+        Route('transactions-export-csv', f'/api/transactions/export/?start_date={today.replace(day=1)}'),
+        Route('budgets-list', '/api/budgets/'),
+        Route('budgets-current-month', '/api/budgets/current_month/'),
+        Route('budget-alerts-list', '/api/budget-alerts/'),
+        Route('recurring-list', '/api/recurring/'),
+        Route('recurring-create', '/api/recurring/', 'post', lambda number: {
+            **new_transaction(number), 'rule': 'FREQ=MONTHLY', 'start_date': today.isoformat(),
+        }),
+        Route('exports-list', '/api/exports/'),
+        Route('exports-create', '/api/exports/', 'post', {'file_format': 'csv'}),
+        Route('summary', '/api/summary/'),
+        Route('dashboard', '/api/dashboard/'),
+        Route('analytics', '/api/analytics/'),
+        Route('forecast', '/api/forecast/'),
+        Route('sync-full', '/api/sync/?limit=500'),
+        Route('analytics-daily', f'/api/analytics/?granularity=day&start_date={today.replace(day=1)}'),
+        Route('async-summary', '/api/async/summary/'),
+        Route('async-dashboard', '/api/async/dashboard/'),
+        Route('async-budgets-current-month', '/api/async/budgets/current_month/'),
+    ]
+    if category is not None:
+        result += [
+            Route('categories-detail', f'/api/categories/{category.id}/'),
+            Route('transactions-create', '/api/transactions/', 'post', new_transaction),
+            Route('transactions-bulk', '/api/transactions/bulk/', 'post', lambda number: {
+                'create': [new_transaction(number)],
+            }),
+            Route('transactions-delete', created_transaction_path, 'delete', template='/api/transactions/{id}/'),
+        ]
+    if transaction is not None:
+        result += [
+            Route('transactions-detail', f'/api/transactions/{transaction.id}/'),
+            Route('transactions-update', f'/api/transactions/{transaction.id}/', 'patch', {
+                'description': transaction.description,
+            }),
+        ]
+    if budget is not None:
+        result += [
+            Route('budgets-detail', f'/api/budgets/{budget.id}/'),
+            Route('budgets-update', f'/api/budgets/{budget.id}/', 'patch', {'amount': str(budget.amount)}),
+        ]
+    if recurring is not None:
+        result.append(Route('recurring-detail', f'/api/recurring/{recurring.id}/'))
+    if export_job is not None:
+        result.append(Route('exports-detail', f'/api/exports/{export_job.id}/'))
+    return sorted(result, key=lambda route: route.name)
+
+
+def high_water_marks(user):
+    """The highest id of each table the write routes add to, so cleanup() can remove what they added"""
+    return {
+        model: model.objects.filter(user=user).order_by('-id').values_list('id', flat=True).first() or 0
+        for model in (Transaction, Category, RecurringTransaction, ExportJob, BudgetAlert)
+    }
+
+
+def cleanup(user, marks):
+    """Delete the rows the write routes created, through the ORM so rollups and caches follow"""
+    for model, mark in marks.items():
+        model.objects.filter(user=user, id__gt=mark).delete()
+    User.objects.filter(username__startswith=SIGNUP_PREFIX).delete()
+
+
+def run_route(client, route, requests, headers, nonce=None):
+    """
+    Send a route requests times and return its statistics.
+
+    With a nonce, each GET carries a unique query parameter so it misses the
+    response cache and measures the work behind it.
+    """
+    latencies = []
+    query_counts = []
+    status_codes = {}
+    send = getattr(client, route.method)
+    elapsed = 0.0
+    for number in range(requests):
+        path, data = route.request_args(number)
+        if nonce is not None and route.method == 'get':
+            path += f'{"&" if "?" in path else "?"}_bench={nonce}-{number}'
+        kwargs = {'headers': headers} if route.authenticated else {}
+        if data is not None:
+            kwargs.update(data=data, content_type='application/json')
+
+        # Queries the async views run on pool threads use those threads' connections and are not counted
+        captures = [CaptureQueriesContext(connection) for connection in connections.all()]
+        for capture in captures:
+            capture.__enter__()
+        started = time.perf_counter()
+        try:
+            response = send(path, **kwargs)
+            # Streaming responses do their work while being consumed
+            if response.streaming:
+                b''.join(response.streaming_content)
+        finally:
+            latency = time.perf_counter() - started
+            for capture in captures:
+                capture.__exit__(None, None, None)
+
+        elapsed += latency
+        latencies.append(latency)
+        query_counts.append(sum(len(capture) for capture in captures))
+        status_codes[str(response.status_code)] = status_codes.get(str(response.status_code), 0) + 1
+
+    return {
+        **route.describe(),
+        'requests': requests,
+        'errors': sum(total for code, total in status_codes.items() if int(code) >= 400),
+        'status_codes': status_codes,
+        'queries': {
+            'min': min(query_counts),
+            'median': statistics.median(query_counts),
+            'max': max(query_counts),
+        },
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies) * 1000, 3),
+            'p50': round(percentile(latencies, 0.5) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+        },
+        'throughput': round(requests / elapsed, 2) if elapsed else None,
+    }
@@ -0,0 +1,126 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .utils import month_range
+
+KEY_PREFIX = 'budgetscope'
+
+
+def user_scope(user_id):
+    """Everything belonging to a user"""
+    return ('user', user_id)
+
+
+def period_scope(user_id, year, month):
+    """A user's transactions and budgets for one month"""
+    return ('period', user_id, int(year), int(month))
+
+
+def categories_scope(user_id):
+    """A user's own categories, or the shared defaults when user_id is None"""
+    return ('categories', user_id)
+
+
+def exchange_rates_scope():
+    """Every stored exchange rate"""
+    return ('exchange-rates',)
+
+
+def _generation_key(scope):
+    return ':'.join([KEY_PREFIX, 'generation'] + [str(part) for part in scope])
+
+
+def generations(scopes):
+    """Return the current generation token of each scope"""
+    keys = [_generation_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # A fresh random token never matches entries cached before an eviction
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def invalidate(scopes):
+    """Start a new generation for each scope, orphaning every entry that depended on it"""
+    cache.set_many({_generation_key(scope): uuid.uuid4().hex for scope in scopes}, None)
+
+
+def response_key(name, user_id, query_string, scopes):
+    """
+    Return the (ETag, cache key) pair of a cached response.
+
+    Both come from one digest of the handler name, the user, today's date, the
+    query string and the current generation of every scope the response reads.
+    The name rather than the path identifies the endpoint, so the sync and
+    async views of one endpoint share their ETags and cache entries.
+    """
+    today = timezone.now().date().isoformat()
+    parts = [name, user_id, today, query_string] + generations(scopes)
+    digest = hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f'"{digest}"', f'{KEY_PREFIX}:response:{digest}'
+
+
+def response_headers(etag):
+    """Headers that let clients revalidate a cached response with If-None-Match"""
+    return {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+
+def cache_response(name, scopes):
+    """
+    Cache the data of a GET handler per user, keyed on the scopes it reads.
+
+    scopes(request) returns the scopes the response depends on. The cache key
+    doubles as the ETag, so a matching If-None-Match is answered with 304
+    without reading the cached entry.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            etag, key = response_key(name, request.user.id, request.META.get('QUERY_STRING', ''), scopes(request))
+            headers = response_headers(etag)
+
+            if etag in request.headers.get('If-None-Match', ''):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+            data = cache.get(key)
+            if data is None:
+                response = handler(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                data = response.data
+                cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+            return Response(data, headers=headers)
+        return wrapper
+    return decorator
+
+
+def transaction_scopes(user_id, months):
+    """Scopes touched by writing a user's transactions or budgets in the given (year, month) pairs"""
+    return [user_scope(user_id)] + [period_scope(user_id, year, month) for year, month in set(months)]
+
+
+def summary_scopes(request):
+    """Scopes read by a monthly summary for the month and year query parameters"""
+    # Invalid periods fall back to the current month; the view rejects them uncached
+    try:
+        start, _ = month_range(request.GET.get('month'), request.GET.get('year'))
+    except (TypeError, ValueError):
+        start = timezone.now().date()
+    return [period_scope(request.user.id, start.year, start.month)]
+
+
+def category_scopes(category):
+    """Scopes touched by writing a category"""
+    scopes = [categories_scope(category.user_id)]
+    if category.user_id is not None:
+        scopes.append(user_scope(category.user_id))
+    return scopes
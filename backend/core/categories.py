@@ -0,0 +1,101 @@
+from itertools import islice
+
+from django.db import transaction
+
+from .cache import categories_scope, generations, invalidate, user_scope
+from .models import Category
+
+DEFAULT_CATEGORIES = {
+    'income': (
+        'Salary',
+        'Freelance',
+        'Investments',
+        'Gifts',
+        'Other Income',
+    ),
+    'expense': (
+        'Housing',
+        'Food',
+        'Transportation',
+        'Utilities',
+        'Healthcare',
+        'Entertainment',
+        'Shopping',
+        'Education',
+        'Personal Care',
+        'Debt Payments',
+        'Savings',
+        'Other Expenses',
+    ),
+}
+
+# (generation, categories) of the shared defaults this process last loaded
+_defaults = (None, ())
+
+
+def default_categories():
+    """
+    The shared default categories, ordered by id.
+
+    The rows are kept in-process and reloaded only when the generation of the
+    shared categories scope moves on, which every write to them does. The
+    instances are shared between requests and must not be modified.
+    """
+    global _defaults
+    generation, = generations([categories_scope(None)])
+    if _defaults[0] != generation:
+        categories = Category.objects.filter(user__isnull=True, is_default=True).order_by('id')
+        _defaults = (generation, tuple(categories))
+    return _defaults[1]
+
+
+def default_category_rows():
+    """Yield (name, type) for every default category"""
+    for category_type, names in DEFAULT_CATEGORIES.items():
+        for name in names:
+            yield name, category_type
+
+
+def provision_defaults():
+    """Create the shared default categories that are missing; return how many were created"""
+    # No unique constraint covers rows without a user, so check first
+    existing = set(Category.objects.filter(user__isnull=True).values_list('name', 'type'))
+    missing = [
+        Category(name=name, type=category_type, user=None, is_default=True)
+        for name, category_type in default_category_rows()
+        if (name, category_type) not in existing
+    ]
+    if missing:
+        Category.objects.bulk_create(missing)
+        transaction.on_commit(lambda: invalidate([categories_scope(None)]))
+    return len(missing)
+
+
+def provision_categories(user_ids, batch_size=1000):
+    """
+    Give each user their own copy of the default categories.
+
+    Rows are inserted for batch_size users at a time; ones a user already has
+    are skipped by the (name, user, type) constraint. Returns the number of
+    users processed.
+    """
+    user_ids = iter(user_ids)
+    rows = list(default_category_rows())
+    provisioned = 0
+    while True:
+        chunk = list(islice(user_ids, batch_size))
+        if not chunk:
+            break
+        Category.objects.bulk_create(
+            [
+                Category(name=name, type=category_type, user_id=user_id, is_default=False)
+                for user_id in chunk
+                for name, category_type in rows
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+        scopes = [scope for user_id in chunk for scope in (categories_scope(user_id), user_scope(user_id))]
+        transaction.on_commit(lambda scopes=scopes: invalidate(scopes))
+        provisioned += len(chunk)
+    return provisioned
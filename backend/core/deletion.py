@@ -0,0 +1,202 @@
+"""
+Set-based category merges and deletions of categories and users.
+
+Django's delete() collects every dependent row into memory before issuing
+any SQL, and holds one transaction open over the whole cascade. For a
+category or a user with years of transactions that is a lot of memory and a
+long lock. The functions here work through the dependent rows in chunks of
+ids, one short transaction per chunk, keeping rollups, search vectors,
+tombstones and cached responses in step with set-based writes. Once the
+heavy rows are gone the remaining delete() has little left to collect.
+
+An interrupted run leaves consistent data behind and can simply be repeated.
+"""
+from django.db import transaction
+from django.db.models import Case, DecimalField, Exists, F, OuterRef, Subquery, When
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from . import alerts, cache, rollups, routers, search
+from .exports import delete_export_file
+from .models import Budget, BudgetAlert, ExchangeRate, ExportJob, MonthlyRollup, RecurringTransaction, Tombstone, Transaction
+
+CHUNK_SIZE = 2000
+
+
+def _chunks(queryset, chunk_size):
+    """Yield the ids of the queryset in ascending chunks, reading each chunk afresh"""
+    last = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def _raw_delete(queryset):
+    # Django's own fast path for rows without signals or dependents: a single DELETE
+    return queryset._raw_delete(queryset.db)
+
+
+def _invalidate(months_by_user):
+    for user_id, months in months_by_user.items():
+        cache.invalidate(cache.transaction_scopes(user_id, months))
+        routers.pin_to_primary(user_id)
+
+
+def _tombstones(model_name, rows, deleted_at):
+    Tombstone.objects.bulk_create([
+        Tombstone(user_id=user_id, model=model_name, object_id=pk, deleted_at=deleted_at)
+        for pk, user_id in rows
+    ])
+
+
+def move_transactions(category, target, chunk_size=CHUNK_SIZE):
+    """
+    Move every transaction of category to target, or leave them uncategorized when target is None.
+
+    Returns the number of transactions moved.
+    """
+    target_id = target.pk if target is not None else None
+    moved = 0
+    for ids in _chunks(Transaction.objects.filter(category=category), chunk_size):
+        months_by_user = {}
+        with transaction.atomic():
+            chunk = Transaction.objects.filter(id__in=ids, category=category)
+            buckets = rollups.aggregate(chunk)
+            count = chunk.update(category_id=target_id, updated_at=timezone.now())
+            for bucket in buckets:
+                rollups.adjust((bucket.user_id, bucket.year, bucket.month, category.pk, bucket.type),
+                               -bucket.total, -bucket.count)
+                rollups.adjust((bucket.user_id, bucket.year, bucket.month, target_id, bucket.type),
+                               bucket.total, bucket.count)
+                months_by_user.setdefault(bucket.user_id, set()).add((bucket.year, bucket.month))
+                if bucket.type == 'expense':
+                    alerts.check_bucket(bucket.user_id, bucket.year, bucket.month, target_id)
+            search.update_search_vectors(Transaction.objects.filter(id__in=ids))
+        _invalidate(months_by_user)
+        moved += count
+    return moved
+
+
+def _delete_budgets(queryset, chunk_size):
+    """Delete the budgets chunk by chunk, leaving tombstones for delta sync"""
+    deleted = 0
+    for ids in _chunks(queryset, chunk_size):
+        months_by_user = {}
+        with transaction.atomic():
+            rows = list(Budget.objects.filter(id__in=ids).values_list('id', 'user_id', 'year', 'month'))
+            _tombstones('budget', [(pk, user_id) for pk, user_id, _, _ in rows], timezone.now())
+            _raw_delete(BudgetAlert.objects.filter(budget_id__in=ids))
+            deleted += _raw_delete(Budget.objects.filter(id__in=ids))
+        for _, user_id, year, month in rows:
+            months_by_user.setdefault(user_id, set()).add((year, month))
+        _invalidate(months_by_user)
+    return deleted
+
+
+def move_budgets(category, target, chunk_size=CHUNK_SIZE):
+    """
+    Move every budget of category to target.
+
+    A budget whose period target already has a budget for is added into that
+    budget, converted into its currency, and removed. Returns (moved, merged)
+    counts.
+    """
+    same_period = {
+        'user_id': OuterRef('user_id'),
+        'year': OuterRef('year'),
+        'month': OuterRef('month'),
+    }
+    # Through the base currency, at the rates in effect by the end of the budgets' month
+    source_rate = ExchangeRate.objects.month_rate(OuterRef('currency'), OuterRef('year'), OuterRef('month'))
+    target_rate = ExchangeRate.objects.month_rate(OuterRef(OuterRef('currency')), OuterRef('year'), OuterRef('month'))
+    sources = Budget.objects.filter(category=category, **same_period).annotate(
+        target_amount=Case(
+            When(currency=OuterRef('currency'), then=F('amount')),
+            default=Round(F('amount') * source_rate / target_rate, 2),
+            output_field=DecimalField(max_digits=10, decimal_places=2)
+        )
+    )
+    merged_into = Budget.objects.filter(category=target).filter(Exists(sources))
+    colliding = Budget.objects.filter(category=category).filter(
+        Exists(Budget.objects.filter(category=target, **same_period))
+    )
+
+    # One budget per period at most, and adding must not happen twice if interrupted
+    with transaction.atomic():
+        months_by_user = {}
+        merged_ids = []
+        for pk, user_id, year, month in merged_into.values_list('id', 'user_id', 'year', 'month'):
+            merged_ids.append(pk)
+            months_by_user.setdefault(user_id, set()).add((year, month))
+        merged_into.update(amount=F('amount') + Subquery(sources.values('target_amount')[:1]), updated_at=timezone.now())
+        merged = _delete_budgets(colliding, chunk_size)
+        # The raised amounts may no longer reach thresholds recorded earlier
+        alerts.evaluate(Budget.objects.filter(id__in=merged_ids), reset=True)
+    _invalidate(months_by_user)
+
+    moved = 0
+    for ids in _chunks(Budget.objects.filter(category=category), chunk_size):
+        months_by_user = {}
+        with transaction.atomic():
+            rows = list(Budget.objects.filter(id__in=ids).values_list('user_id', 'year', 'month'))
+            moved += Budget.objects.filter(id__in=ids).update(category=target, updated_at=timezone.now())
+            # They now follow the spending of the target category
+            alerts.evaluate(Budget.objects.filter(id__in=ids), reset=True)
+        for user_id, year, month in rows:
+            months_by_user.setdefault(user_id, set()).add((year, month))
+        _invalidate(months_by_user)
+    return moved, merged
+
+
+def _delete_emptied_rollups(category):
+    # Every transaction has left the category, so its buckets only hold zeros
+    _raw_delete(MonthlyRollup.objects.filter(category=category, count=0))
+
+
+def merge_category(category, target, delete=True, chunk_size=CHUNK_SIZE):
+    """
+    Move the transactions, budgets and recurring rules of category to target.
+
+    With delete the emptied category is removed afterwards. Returns the counts
+    of what moved.
+    """
+    result = {
+        'transactions': move_transactions(category, target, chunk_size),
+    }
+    result['budgets'], result['budgets_merged'] = move_budgets(category, target, chunk_size)
+    result['recurring'] = RecurringTransaction.objects.filter(category=category).update(category=target)
+    _delete_emptied_rollups(category)
+    if delete:
+        category.delete()
+    return result
+
+
+def delete_category(category, chunk_size=CHUNK_SIZE):
+    """Delete a category, leaving its transactions uncategorized, without a single large cascade"""
+    move_transactions(category, None, chunk_size)
+    _delete_budgets(Budget.objects.filter(category=category), chunk_size)
+    RecurringTransaction.objects.filter(category=category).update(category=None)
+    _delete_emptied_rollups(category)
+    category.delete()
+
+
+def delete_user(user, chunk_size=CHUNK_SIZE):
+    """Delete a user and everything they own, the largest tables chunk by chunk"""
+    # Locked out first, so nothing new is written while the rows go
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+
+    # Rollups and tombstones of a user being deleted need no upkeep
+    for model in (Transaction, BudgetAlert, Budget, MonthlyRollup, Tombstone):
+        queryset = model.objects.filter(user=user)
+        for ids in _chunks(queryset, chunk_size):
+            with transaction.atomic():
+                _raw_delete(model.objects.filter(id__in=ids))
+
+    for job in ExportJob.objects.filter(user=user).exclude(file=''):
+        delete_export_file(job.file)
+    cache.invalidate([cache.user_scope(user.pk)])
+    user.delete()
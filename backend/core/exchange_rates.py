@@ -0,0 +1,114 @@
+"""
+Loading daily exchange rates from CSV files.
+
+Rollups hold totals already converted to the base currency, so storing rates
+recomputes the months converted at them.
+"""
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Q
+from django.db.models.functions import ExtractMonth, ExtractYear
+from rest_framework import serializers
+
+from . import alerts, cache, fx, rollups
+from .models import Budget, ExchangeRate, Transaction
+
+
+def read_rates(lines):
+    """
+    Parse CSV lines with date, currency and rate columns.
+
+    Returns (rates, errors): ExchangeRate rows and (line number, message) pairs
+    for lines that could not be used.
+    """
+    rates = []
+    errors = []
+    for line_number, row in enumerate(csv.DictReader(lines), start=2):
+        try:
+            currency = row['currency'].strip().upper()
+            day = serializers.DateField().to_internal_value(row['date'].strip())
+            value = Decimal(row['rate'].strip())
+        except (KeyError, AttributeError, InvalidOperation, serializers.ValidationError):
+            errors.append((line_number, 'Expected a date, a currency and a rate.'))
+            continue
+        if not fx.CURRENCY_CODE.match(currency) or currency == settings.BASE_CURRENCY:
+            errors.append((line_number, f'{currency!r} is not a foreign currency code.'))
+        elif not value.is_finite() or value <= 0:
+            errors.append((line_number, 'The rate must be positive.'))
+        else:
+            rates.append(ExchangeRate(currency=currency, date=day, rate=value))
+    return rates, errors
+
+
+def store_rates(rates, batch_size=1000):
+    """
+    Insert or replace the rates, then bring the totals converted at them up to date.
+
+    Rollups hold converted totals, so every month from a currency's earliest
+    changed date on is recomputed for the users with transactions in it. A
+    currency's new oldest rate also applies to everything before it. Rates and
+    rollups change in one transaction, and the last of several rates given for
+    the same currency and date wins. Returns the number of rollup months
+    recomputed.
+    """
+    try:
+        return _store_rates(rates, batch_size)
+    except Exception:
+        # This process may have read rates that were rolled back
+        fx.forget_rates()
+        raise
+
+
+@transaction.atomic
+def _store_rates(rates, batch_size):
+    # One row may only be written once per INSERT ... ON CONFLICT
+    rates = list({(exchange_rate.currency, exchange_rate.date): exchange_rate for exchange_rate in rates}.values())
+    earliest = {}
+    for exchange_rate in rates:
+        day = earliest.get(exchange_rate.currency, exchange_rate.date)
+        earliest[exchange_rate.currency] = min(day, exchange_rate.date)
+    if not earliest:
+        return 0
+    oldest = dict(
+        ExchangeRate.objects.filter(currency__in=earliest).values_list('currency').annotate(Min('date')).order_by()
+    )
+
+    ExchangeRate.objects.bulk_create(
+        rates,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=['currency', 'date'],
+        update_fields=['rate']
+    )
+    fx.forget_rates()
+
+    transactions = Q()
+    budgets = Q()
+    for currency, day in earliest.items():
+        if currency not in oldest or day <= oldest[currency]:
+            transactions |= Q(currency=currency)
+            budgets |= Q(currency=currency)
+        else:
+            transactions |= Q(currency=currency, date__gte=day)
+            budgets |= Q(currency=currency) & (Q(year__gt=day.year) | Q(year=day.year, month__gte=day.month))
+
+    months_by_user = {}
+    for user_id, year, month in Transaction.objects.filter(transactions).order_by().annotate(
+        rollup_year=ExtractYear('date'),
+        rollup_month=ExtractMonth('date')
+    ).values_list('user_id', 'rollup_year', 'rollup_month').distinct():
+        months_by_user.setdefault(user_id, set()).add((year, month))
+    for user_id, months in months_by_user.items():
+        rollups.refresh_months(user_id, months)
+        alerts.check_months(user_id, months)
+    refreshed = sum(len(months) for months in months_by_user.values())
+
+    # Budgets in these currencies convert their spending at the new rates too
+    for user_id, year, month in Budget.objects.filter(budgets).values_list('user_id', 'year', 'month'):
+        months_by_user.setdefault(user_id, set()).add((year, month))
+    scopes = [scope for user_id, months in months_by_user.items() for scope in cache.transaction_scopes(user_id, months)]
+    transaction.on_commit(lambda: cache.invalidate(scopes))
+    return refreshed
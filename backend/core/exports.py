@@ -0,0 +1,242 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .models import ExportJob, Transaction
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Parquet exports are optional
+    pyarrow = None
+
+EXPORT_FORMATS = ('csv', 'ndjson', 'parquet')
+EXPORT_COLUMNS = (
+    'id', 'date', 'type', 'amount', 'currency', 'category_id', 'category', 'description', 'created_at'
+)
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+CHUNK_SIZE = 2000
+
+
+def check_format(file_format):
+    """Raise a ValidationError unless the format can be exported here"""
+    if file_format not in EXPORT_FORMATS:
+        raise serializers.ValidationError(f'Must be one of: {", ".join(EXPORT_FORMATS)}.')
+    if file_format == 'parquet' and pyarrow is None:
+        raise serializers.ValidationError('Parquet exports need the pyarrow package installed.')
+
+
+def export_rows(user, filters):
+    """
+    The user's transactions matching the filters, oldest first, as tuples in EXPORT_COLUMNS order.
+
+    Rows are read CHUNK_SIZE at a time, through a server-side cursor or, where
+    those are disabled, keyset batches, so memory does not grow with the size
+    of the history.
+    """
+    queryset = Transaction.objects.filter(user=user).filter_params(filters).order_by('date', 'id').values_list(
+        'id', 'date', 'type', 'amount', 'currency', 'category_id', 'category__name', 'description', 'created_at'
+    )
+    if connections[queryset.db].settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        return _keyset_rows(queryset)
+    return queryset.iterator(chunk_size=CHUNK_SIZE)
+
+
+def _keyset_rows(queryset):
+    # Without a server-side cursor the driver would buffer the whole result
+    batch = list(queryset[:CHUNK_SIZE])
+    while batch:
+        yield from batch
+        row_id, date = batch[-1][0], batch[-1][1]
+        batch = list(queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=row_id))[:CHUNK_SIZE])
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, CHUNK_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def _text_values(row):
+    row_id, date, transaction_type, amount, currency, category_id, category, description, created_at = row
+    return (row_id, date.isoformat(), transaction_type, str(amount), currency, category_id, category, description,
+            created_at.isoformat())
+
+
+def csv_chunks(rows):
+    """Yield a CSV export as encoded chunks of CHUNK_SIZE rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _batches(rows):
+        writer.writerows(_text_values(row) for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    # Only the header is left when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def ndjson_chunks(rows):
+    """Yield one JSON object per line, in encoded chunks of CHUNK_SIZE rows"""
+    for batch in _batches(rows):
+        lines = [json.dumps(dict(zip(EXPORT_COLUMNS, _text_values(row)))) for row in batch]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that hands back whatever was written since the last drain"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(rows):
+    """Yield a Parquet file with one row group per CHUNK_SIZE rows"""
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('date', pyarrow.date32()),
+        ('type', pyarrow.string()),
+        ('amount', pyarrow.decimal128(10, 2)),
+        ('currency', pyarrow.string()),
+        ('category_id', pyarrow.int64()),
+        ('category', pyarrow.string()),
+        ('description', pyarrow.string()),
+        ('created_at', pyarrow.timestamp('us', tz='UTC')),
+    ])
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for batch in _batches(rows):
+        columns = [
+            pyarrow.array(values, type=field.type)
+            for values, field in zip(zip(*batch), schema)
+        ]
+        writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+        yield sink.drain()
+    # The footer is written on close
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+    'parquet': parquet_chunks,
+}
+
+
+def export_chunks(user, file_format, filters):
+    """Yield the encoded export of a user's transactions"""
+    return WRITERS[file_format](export_rows(user, filters))
+
+
+def export_filename(file_format):
+    """Name an export file after the time it was made"""
+    return f'transactions-{timezone.now():%Y%m%d-%H%M%S}.{file_format}'
+
+
+def delete_export_file(file):
+    """Remove an export file, and the random directory it was stored in"""
+    name = file.name
+    file.storage.delete(name)
+    directory = os.path.dirname(name)
+    if directory:
+        try:
+            os.rmdir(file.storage.path(directory))
+        except (NotImplementedError, OSError):
+            # Storage without directories, or a directory already gone
+            pass
+
+
+def claim_export_job():
+    """
+    Mark the oldest pending export job as running and return it, or None when the queue is empty.
+
+    A job still running EXPORT_JOB_TIMEOUT seconds after it started is taken
+    to have lost its worker, and is claimed again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    with transaction.atomic():
+        # Concurrent workers skip the jobs another one has locked
+        job = ExportJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status='pending') | Q(status='running', started_at__lt=stale)
+        ).order_by('created_at').first()
+        if job is not None:
+            job.status = 'running'
+            job.started_at = now
+            job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def run_export_job(job):
+    """Write a job's export to a temporary file, then store it on the job"""
+    row_count = 0
+
+    def counted(rows):
+        nonlocal row_count
+        for row in rows:
+            row_count += 1
+            yield row
+
+    try:
+        with tempfile.TemporaryFile() as output:
+            rows = counted(export_rows(job.user, job.filters))
+            for chunk in WRITERS[job.file_format](rows):
+                output.write(chunk)
+            output.seek(0)
+            job.file.save(export_filename(job.file_format), File(output), save=False)
+    except Exception as exc:
+        job.status = 'failed'
+        job.error = str(exc)
+    else:
+        job.status = 'done'
+        job.row_count = row_count
+    job.finished_at = timezone.now()
+    # Only the worker that claimed the job last may finish it; a slow one it was taken from backs off
+    finished = ExportJob.objects.filter(pk=job.pk, started_at=job.started_at).update(
+        file=job.file.name,
+        status=job.status,
+        error=job.error,
+        row_count=job.row_count,
+        finished_at=job.finished_at
+    )
+    if not finished and job.file:
+        delete_export_file(job.file)
+    return job
@@ -0,0 +1,147 @@
+"""
+Month-end spending forecasts and unusual-spending flags.
+
+A user's daily expense totals per category are read in one grouped query
+over a fixed trailing window, never the whole history, so the cost stays
+the same for a user with ten years of transactions as for one with ten
+weeks. The series become a (category x day) NumPy matrix, and moving
+averages and z-scores come from cumulative sums over it rather than
+Python loops over rows.
+"""
+from calendar import monthrange
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import fx
+from .models import Transaction
+
+try:
+    import numpy
+except ImportError:  # Forecasts are optional
+    numpy = None
+
+DEFAULT_WINDOW = 30
+MAX_WINDOW = 90
+# Days, up to today, checked for anomalies against the window before each of them
+ANOMALY_DAYS = 30
+DEFAULT_Z_THRESHOLD = 3.0
+MAX_ANOMALIES = 50
+
+
+class ForecastUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Forecasts need the numpy package installed.'
+    default_code = 'forecast_unavailable'
+
+
+def daily_series(user, start, end):
+    """
+    Daily expense totals per category from start through end, in the base currency, in one grouped query.
+
+    Returns (categories, names, matrix): the category ids (None for
+    uncategorized), their names, and a float matrix with one row per category
+    and one column per day.
+    """
+    rows = Transaction.objects.filter(
+        user=user, type='expense', date__gte=start, date__lte=end
+    ).order_by().values_list('category_id', 'category__name', 'date').annotate(total=Sum(fx.base_amount()))
+    rows = list(rows)
+    days = (end - start).days + 1
+    if not rows:
+        return [], [], numpy.zeros((0, days))
+
+    category_ids, category_names, dates, totals = zip(*rows)
+    names = dict(zip(category_ids, category_names))
+    # Uncategorized spending gets a key of its own
+    keys = numpy.array([-1 if pk is None else pk for pk in category_ids])
+    unique_keys, row_index = numpy.unique(keys, return_inverse=True)
+    day_index = numpy.array([day.toordinal() for day in dates]) - start.toordinal()
+
+    matrix = numpy.zeros((len(unique_keys), days))
+    numpy.add.at(matrix, (row_index, day_index), numpy.array(totals, dtype=float))
+    categories = [None if key == -1 else int(key) for key in unique_keys]
+    return categories, [names[pk] for pk in categories], matrix
+
+
+def rolling_stats(matrix, window):
+    """
+    Mean and standard deviation of every span of window days, per row.
+
+    Column j of the results covers days j through j + window - 1.
+    """
+    sums = numpy.zeros((matrix.shape[0], matrix.shape[1] + 1))
+    squares = numpy.zeros_like(sums)
+    numpy.cumsum(matrix, axis=1, out=sums[:, 1:])
+    numpy.cumsum(matrix ** 2, axis=1, out=squares[:, 1:])
+    mean = (sums[:, window:] - sums[:, :-window]) / window
+    variance = (squares[:, window:] - squares[:, :-window]) / window - mean ** 2
+    # Rounding in the cumulative sums can push a zero variance slightly negative
+    return mean, numpy.sqrt(numpy.maximum(variance, 0))
+
+
+def build_forecast(user, today, window=DEFAULT_WINDOW, z_threshold=DEFAULT_Z_THRESHOLD):
+    """Month-to-date spending, its month-end projection and recent anomalies, per category and overall"""
+    if numpy is None:
+        raise ForecastUnavailable()
+
+    month_start = today.replace(day=1)
+    days_in_month = monthrange(today.year, today.month)[1]
+    days_remaining = days_in_month - today.day
+    # Enough history for the month so far and a full window behind every day checked
+    start = min(month_start, today - timedelta(days=ANOMALY_DAYS + window - 1))
+    categories, names, matrix = daily_series(user, start, today)
+
+    days = matrix.shape[1]
+    mean, std = rolling_stats(matrix, window)
+    # The daily rate expected for the rest of the month is the average of the last window days
+    daily_rate = mean[:, -1]
+    month_to_date = matrix[:, (month_start - start).days:].sum(axis=1)
+    projected = month_to_date + daily_rate * days_remaining
+
+    # Each recent day against the window of days before it
+    recent = matrix[:, days - ANOMALY_DAYS:]
+    baseline_mean = mean[:, days - ANOMALY_DAYS - window:days - window]
+    baseline_std = std[:, days - ANOMALY_DAYS - window:days - window]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        z_scores = numpy.where(baseline_std > 0, (recent - baseline_mean) / baseline_std, 0)
+    flagged_rows, flagged_days = numpy.nonzero((z_scores >= z_threshold) & (recent > 0))
+    order = numpy.argsort(-z_scores[flagged_rows, flagged_days], kind='stable')[:MAX_ANOMALIES]
+
+    first_recent = today - timedelta(days=ANOMALY_DAYS - 1)
+    anomalies = [
+        {
+            'date': first_recent + timedelta(days=int(flagged_days[i])),
+            'category': categories[flagged_rows[i]],
+            'category_name': names[flagged_rows[i]],
+            'amount': recent[flagged_rows[i], flagged_days[i]],
+            'expected': baseline_mean[flagged_rows[i], flagged_days[i]],
+            'z_score': round(float(z_scores[flagged_rows[i], flagged_days[i]]), 2),
+        }
+        for i in order
+    ]
+
+    return {
+        'month': today.month,
+        'year': today.year,
+        'currency': settings.BASE_CURRENCY,
+        'as_of': today,
+        'window': window,
+        'days_remaining': days_remaining,
+        'month_to_date': month_to_date.sum(),
+        'forecast': projected.sum(),
+        'categories': [
+            {
+                'category': category,
+                'category_name': name,
+                'month_to_date': month_to_date[row],
+                'moving_average': daily_rate[row],
+                'forecast': projected[row],
+            }
+            for row, (category, name) in enumerate(zip(categories, names))
+        ],
+        'anomalies': anomalies,
+    }
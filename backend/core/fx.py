@@ -0,0 +1,91 @@
+"""
+Conversion of amounts to the base currency.
+
+An amount converts at the rate in effect on its date: the newest stored rate
+on or before it, or the oldest rate for dates before the table starts. Each
+converted amount is rounded to cents before it is summed, the same way in
+SQL (base_amount) and in Python (to_base), so rollups kept up one row at a
+time agree with rollups rebuilt by an aggregate query.
+
+Python conversions read rates each process keeps in memory. They carry the
+generation of the shared exchange rates scope they were read under, and are
+read again once loading rates in any process has moved it on.
+"""
+import re
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Q, When
+from django.db.models.functions import Round
+from rest_framework import serializers
+
+from .cache import exchange_rates_scope, generations, invalidate
+from .models import ExchangeRate
+
+CURRENCY_CODE = re.compile(r'^[A-Z]{3}$')
+CENT = Decimal('0.01')
+AMOUNT_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+# currency -> (generation, dates, rates)
+_series = {}
+
+
+def base_amount(amount='amount', currency='currency', date='date'):
+    """An expression converting each row's amount to the base currency, for use inside aggregates"""
+    rate = ExchangeRate.objects.rate(OuterRef(currency), Q(date__lte=OuterRef(date)))
+    return Case(
+        When(**{currency: settings.BASE_CURRENCY}, then=F(amount)),
+        default=Round(F(amount) * rate, 2),
+        output_field=AMOUNT_FIELD
+    )
+
+
+def _rates(currency):
+    # The currency's whole history, sorted by date; a decade of daily rates is a few thousand rows
+    generation, = generations([exchange_rates_scope()])
+    cached = _series.get(currency)
+    if cached is None or cached[0] != generation:
+        rows = list(ExchangeRate.objects.filter(currency=currency).order_by('date').values_list('date', 'rate'))
+        cached = (generation, [day for day, _ in rows], [rate for _, rate in rows])
+        # A currency without rates yet is looked up again next time
+        if rows:
+            _series[currency] = cached
+    return cached[1], cached[2]
+
+
+def forget_rates():
+    """Make every process read the rates again, e.g. after new ones were stored"""
+    # This process reads the new rates at once; the others once they are committed, or
+    # they could read the old rates again under the new generation
+    _series.clear()
+    transaction.on_commit(lambda: invalidate([exchange_rates_scope()]))
+
+
+def rate(currency, day):
+    """The rate in effect for a currency on a day, from this process's cache"""
+    if currency == settings.BASE_CURRENCY:
+        return Decimal(1)
+    dates, rates = _rates(currency)
+    if not dates:
+        return Decimal(1)
+    position = bisect_right(dates, day)
+    return rates[position - 1] if position else rates[0]
+
+
+def to_base(amount, currency, day):
+    """Convert an amount to the base currency, rounded like base_amount()"""
+    if currency == settings.BASE_CURRENCY:
+        return amount
+    return (amount * rate(currency, day)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def check_currency(value):
+    """Return the normalised currency code, raising a ValidationError unless amounts in it can be converted"""
+    value = value.strip().upper()
+    if not CURRENCY_CODE.match(value):
+        raise serializers.ValidationError('Must be a three-letter ISO 4217 currency code.')
+    if value != settings.BASE_CURRENCY and not _rates(value)[0]:
+        raise serializers.ValidationError(f'No exchange rates are loaded for {value}.')
+    return value
@@ -0,0 +1,286 @@
+import csv
+import hashlib
+import re
+from datetime import datetime
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from .categories import default_categories
+from .fx import check_currency
+from .models import Category, Transaction
+from .signals import transactions_changed
+
+IMPORT_FORMATS = ('csv', 'ofx', 'qif')
+MAX_REPORTED_ERRORS = 1000
+# Where parse_csv puts the values of a row beyond the header's columns
+EXTRA_FIELDS = '_extra_fields'
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+QIF_DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', "%m/%d'%y", '%m/%d/%y', '%d.%m.%Y')
+
+
+def parse_csv(lines):
+    """Yield (row number, row) pairs from CSV lines with a header row"""
+    reader = csv.DictReader(lines, restkey=EXTRA_FIELDS)
+    for row_number, row in enumerate(reader, start=2):
+        extra = row.pop(EXTRA_FIELDS, None)
+        # Header names are matched case-insensitively
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if extra:
+            row[EXTRA_FIELDS] = extra
+        yield row_number, row
+
+
+def parse_ofx(lines):
+    """Yield (transaction number, row) pairs from the STMTTRN blocks of an OFX statement"""
+    current = None
+    row_number = 0
+    for line in lines:
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            value = value.strip()
+            if tag == 'STMTTRN':
+                if closing:
+                    if current is not None:
+                        row_number += 1
+                        yield row_number, _ofx_row(current)
+                    current = None
+                else:
+                    current = {}
+            elif current is not None and not closing and value:
+                current[tag] = value
+
+
+def _ofx_row(fields):
+    # DTPOSTED looks like 20231105120000[-5:EST]; only the date part matters
+    posted = fields.get('DTPOSTED', '')[:8]
+    date = f'{posted[:4]}-{posted[4:6]}-{posted[6:8]}' if len(posted) == 8 else posted
+    return {
+        'date': date,
+        'amount': fields.get('TRNAMT', ''),
+        'description': fields.get('MEMO') or fields.get('NAME', ''),
+        'external_id': fields.get('FITID', ''),
+    }
+
+
+def parse_qif(lines):
+    """Yield (record number, row) pairs from the records of a QIF file"""
+    current = {}
+    row_number = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('!'):
+            continue
+        if line == '^':
+            if current:
+                row_number += 1
+                yield row_number, current
+            current = {}
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == 'D':
+            current['date'] = _parse_qif_date(value)
+        elif code in ('T', 'U'):
+            current['amount'] = value.replace(',', '')
+        elif code == 'P':
+            current['description'] = value
+        elif code == 'M':
+            current.setdefault('description', value)
+        elif code == 'L':
+            current['category'] = value
+    if current:
+        yield row_number + 1, current
+
+
+def _parse_qif_date(value):
+    value = value.replace(' ', '')
+    for date_format in QIF_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    # Left for the row serializer to reject
+    return value
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+    'qif': parse_qif,
+}
+
+
+class CategoryResolver:
+    """Resolve category names against a user's and the default categories with one query"""
+
+    def __init__(self, user):
+        self.categories = {}
+        categories = [(category.id, category.name, category.type) for category in default_categories()]
+        categories += Category.objects.filter(user=user).values_list('id', 'name', 'type')
+        # Defaults come first so the user's own rows win
+        for category_id, name, category_type in categories:
+            self.categories[(name.strip().casefold(), category_type)] = category_id
+
+    def resolve(self, name, transaction_type):
+        """Return the id of the category with this name and type, or None"""
+        return self.categories.get((name.strip().casefold(), transaction_type))
+
+
+class TransactionImportRowSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    type = serializers.ChoiceField(choices=Transaction.TRANSACTION_TYPES, required=False, allow_blank=True)
+    category = serializers.CharField(required=False, allow_blank=True, default='')
+    currency = serializers.CharField(required=False, allow_blank=True, default='')
+    external_id = serializers.CharField(required=False, allow_blank=True, default='')
+
+    def validate_currency(self, value):
+        # Rows without a currency are in the base currency
+        return check_currency(value) if value else settings.BASE_CURRENCY
+
+    def validate(self, attrs):
+        # Signed amounts without a type are bank-style: negative means money out
+        if not attrs.get('type'):
+            attrs['type'] = 'expense' if attrs['amount'] < 0 else 'income'
+        attrs['amount'] = abs(attrs['amount'])
+
+        attrs['category_id'] = None
+        if attrs['category']:
+            attrs['category_id'] = self.context['categories'].resolve(attrs['category'], attrs['type'])
+            if attrs['category_id'] is None:
+                raise serializers.ValidationError({'category': f"Unknown category '{attrs['category']}'."})
+        return attrs
+
+
+class TransactionImporter:
+    """
+    Stream rows into a user's transactions in validated, batched chunks.
+
+    Every imported row carries a hash of its content (or of the bank's own id),
+    so importing the same file again skips the rows that already exist. Rows
+    that fail validation are reported and skipped, but a file that cannot be
+    read to the end imports nothing.
+    """
+
+    def __init__(self, user, chunk_size=500):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.categories = CategoryResolver(user)
+        self.occurrences = {}
+        self.months = set()
+        self.created = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+
+    @transaction.atomic
+    def run(self, rows):
+        self.started = timezone.now()
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk)
+        if self.months:
+            transactions_changed.send(sender=Transaction, user_id=self.user.id, months=self.months)
+            transaction.on_commit(self.restamp)
+        return {
+            'created': self.created,
+            'skipped': self.skipped,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def import_chunk(self, chunk):
+        pending = {}
+        for row_number, row in chunk:
+            if EXTRA_FIELDS in row:
+                self.add_error(row_number, {'non_field_errors': ['The row has more fields than the header.']})
+                continue
+            serializer = TransactionImportRowSerializer(data=row, context={'categories': self.categories})
+            if not serializer.is_valid():
+                self.add_error(row_number, serializer.errors)
+                continue
+            data = serializer.validated_data
+            import_hash = self.hash_row(data)
+            if import_hash in pending:
+                self.skipped += 1
+                continue
+            pending[import_hash] = Transaction(
+                user=self.user,
+                amount=data['amount'],
+                currency=data['currency'],
+                category_id=data['category_id'],
+                description=data['description'],
+                date=data['date'],
+                type=data['type'],
+                import_hash=import_hash
+            )
+
+        existing = self.existing_hashes(list(pending))
+        new_rows = [row for import_hash, row in pending.items() if import_hash not in existing]
+        if not new_rows:
+            self.skipped += len(pending)
+            return
+
+        Transaction.objects.bulk_create(new_rows, batch_size=self.chunk_size, ignore_conflicts=True)
+        # Rows another import inserted in the meantime were dropped as conflicts; the
+        # stored row for such a hash carries the other import's creation time, not ours
+        stored = set(Transaction.objects.filter(
+            user=self.user,
+            import_hash__in=[row.import_hash for row in new_rows]
+        ).values_list('import_hash', 'created_at'))
+        inserted = [row for row in new_rows if (row.import_hash, row.created_at) in stored]
+        self.created += len(inserted)
+        self.skipped += len(pending) - len(inserted)
+        self.months.update((row.date.year, row.date.month) for row in inserted)
+
+    def restamp(self):
+        """
+        Stamp the imported rows as updated now that they are committed.
+
+        A large import commits long after its rows were stamped, so delta sync
+        cursors may already be past them; see core.sync.
+        """
+        Transaction.objects.filter(user=self.user, created_at__gte=self.started).update(updated_at=timezone.now())
+
+    def existing_hashes(self, hashes):
+        """The import hashes among hashes the user's transactions already have"""
+        return set(Transaction.objects.filter(
+            user=self.user,
+            import_hash__in=hashes
+        ).values_list('import_hash', flat=True))
+
+    def hash_row(self, data):
+        if data['external_id']:
+            key = f"id|{data['external_id']}"
+        else:
+            key = '|'.join(str(data[field]) for field in ('date', 'amount', 'type', 'description', 'category'))
+            # Identical rows within a file are told apart by their position
+            occurrence = self.occurrences.get(key, 0) + 1
+            self.occurrences[key] = occurrence
+            key = f'{key}|{occurrence}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def add_error(self, row_number, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+
+def guess_format(filename):
+    """Guess the import format from a file name, defaulting to CSV"""
+    extension = (filename or '').rsplit('.', 1)[-1].lower()
+    return extension if extension in IMPORT_FORMATS else 'csv'
+
+
+def import_transactions(user, lines, file_format='csv', chunk_size=500):
+    """Import transactions for a user from an iterable of text lines"""
+    importer = TransactionImporter(user, chunk_size=chunk_size)
+    return importer.run(PARSERS[file_format](lines))
@@ -0,0 +1,268 @@
+"""
+Per-request performance instrumentation.
+
+InstrumentationMiddleware times every request and counts it in the
+Prometheus metrics. A sampled share of requests (INSTRUMENTATION_SAMPLE_RATE)
+is also broken down into database, serialization and authentication time,
+with repeated query shapes flagged as likely N+1 queries. The code doing the
+work marks its phases with timed(). Sampled requests get a
+Server-Timing header and a structured log line.
+
+Metrics are kept per process; scrape every worker, or run a single one.
+"""
+import hmac
+import json
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Runs of placeholders in IN (...) lists, collapsed so list length does not change the shape
+PLACEHOLDER_RUN = re.compile(r'%s(?:\s*,\s*%s)+')
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one sampled request spent its time on"""
+
+    def __init__(self):
+        self.queries = []
+        self.timings = defaultdict(float)
+        self.open_timers = set()
+
+    def record_query(self, sql, params, duration):
+        # list.append is atomic, and the async views run queries from several threads
+        self.queries.append((sql, params, duration))
+
+    @property
+    def db_time(self):
+        return sum(duration for _, _, duration in self.queries)
+
+    def duplicates(self):
+        """Return {query shape: count} for shapes run at least INSTRUMENTATION_DUPLICATE_THRESHOLD times"""
+        shapes = Counter(PLACEHOLDER_RUN.sub('%s, ...', sql) for sql, _, _ in self.queries)
+        threshold = settings.INSTRUMENTATION_DUPLICATE_THRESHOLD
+        return {shape: total for shape, total in shapes.items() if total >= threshold}
+
+    def identical_queries(self):
+        """Number of queries that repeat an earlier query with the same parameters"""
+        seen = Counter((sql, repr(params)) for sql, params, _ in self.queries)
+        return sum(total - 1 for total in seen.values())
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to a phase of the current sampled request"""
+    stats = _current.get()
+    # Nested blocks of the same phase, like a serializer inside a serializer, count once
+    if stats is None or phase in stats.open_timers:
+        yield
+        return
+    stats.open_timers.add(phase)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.timings[phase] += time.perf_counter() - started
+        stats.open_timers.discard(phase)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper timing the queries of sampled requests"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, params, time.perf_counter() - started)
+
+
+def install_query_timer(connection):
+    """Add record_query to a database connection"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Metrics:
+    """Prometheus counters and histograms of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = Counter()
+            self.durations = defaultdict(lambda: [0] * (len(DURATION_BUCKETS) + 1))
+            self.duration_sums = Counter()
+            self.sampled = Counter()
+            self.sampled_totals = defaultdict(Counter)
+
+    def observe(self, labels, status_code, duration, stats=None):
+        bucket = bisect_left(DURATION_BUCKETS, duration)
+        with self.lock:
+            self.requests[labels + (str(status_code),)] += 1
+            self.durations[labels][bucket] += 1
+            self.duration_sums[labels] += duration
+            if stats is not None:
+                self.sampled[labels] += 1
+                totals = self.sampled_totals[labels]
+                totals['db_queries'] += len(stats.queries)
+                totals['db_seconds'] += stats.db_time
+                totals['duplicate_queries'] += stats.identical_queries()
+                for phase, seconds in stats.timings.items():
+                    totals[f'{phase}_seconds'] += seconds
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            lines += [
+                '# HELP budgetscope_requests_total Requests handled, by view, action, method and status.',
+                '# TYPE budgetscope_requests_total counter',
+            ]
+            for (view, action, method, status), total in sorted(self.requests.items()):
+                lines.append(
+                    f'budgetscope_requests_total{{view="{view}",action="{action}",method="{method}",'
+                    f'status="{status}"}} {total}'
+                )
+
+            lines += [
+                '# HELP budgetscope_request_duration_seconds Time to produce the response.',
+                '# TYPE budgetscope_request_duration_seconds histogram',
+            ]
+            for labels, buckets in sorted(self.durations.items()):
+                label = _labels(labels)
+                cumulative = 0
+                for bound, total in zip(DURATION_BUCKETS + ('+Inf',), buckets):
+                    cumulative += total
+                    lines.append(f'budgetscope_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'budgetscope_request_duration_seconds_sum{{{label}}} {self.duration_sums[labels]:.6f}')
+                lines.append(f'budgetscope_request_duration_seconds_count{{{label}}} {cumulative}')
+
+            lines += [
+                '# HELP budgetscope_sampled_requests_total Requests broken down by phase.',
+                '# TYPE budgetscope_sampled_requests_total counter',
+            ]
+            for labels, total in sorted(self.sampled.items()):
+                lines.append(f'budgetscope_sampled_requests_total{{{_labels(labels)}}} {total}')
+
+            names = sorted({name for totals in self.sampled_totals.values() for name in totals})
+            for name in names:
+                metric = f'budgetscope_sampled_{name}_total'
+                lines += [
+                    f'# HELP {metric} Sum of {name.replace("_", " ")} over the sampled requests.',
+                    f'# TYPE {metric} counter',
+                ]
+                for labels, totals in sorted(self.sampled_totals.items()):
+                    lines.append(f'{metric}{{{_labels(labels)}}} {totals[name]:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    view, action, method = labels
+    return f'view="{view}",action="{action}",method="{method}"'
+
+
+metrics = Metrics()
+
+
+def view_labels(request):
+    """(view, action, method) of a request, from the URL it resolved to"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ('unmatched', '', request.method)
+    # Viewsets map each HTTP method to an action
+    actions = getattr(match.func, 'actions', None) or {}
+    return (match.view_name, actions.get(request.method.lower(), ''), request.method)
+
+
+class InstrumentationMiddleware:
+    """Times each request, breaking a sampled share of them down by phase"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    async def __acall__(self, request):
+        stats, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, started)
+
+    def start(self):
+        sampled = random.random() < settings.INSTRUMENTATION_SAMPLE_RATE
+        stats = RequestStats() if sampled else None
+        return stats, _current.set(stats), time.perf_counter()
+
+    def finish(self, request, response, stats, started):
+        duration = time.perf_counter() - started
+        labels = view_labels(request)
+        metrics.observe(labels, response.status_code, duration, stats)
+        if stats is None:
+            return response
+
+        timings = {'db': stats.db_time, **stats.timings, 'total': duration}
+        response['Server-Timing'] = ', '.join(
+            f'{phase};dur={seconds * 1000:.1f}' + (f';desc="{len(stats.queries)} queries"' if phase == 'db' else '')
+            for phase, seconds in timings.items()
+        )
+
+        duplicates = stats.duplicates()
+        record = {
+            'path': request.path,
+            'view': labels[0],
+            'action': labels[1],
+            'method': labels[2],
+            'status': response.status_code,
+            'user_id': getattr(getattr(request, 'user', None), 'id', None),
+            'queries': len(stats.queries),
+            'identical_queries': stats.identical_queries(),
+            'duplicate_shapes': [{'sql': sql, 'count': total} for sql, total in duplicates.items()],
+            **{f'{phase}_ms': round(seconds * 1000, 2) for phase, seconds in timings.items()},
+        }
+        slow = duration * 1000 >= settings.INSTRUMENTATION_SLOW_MS
+        logger.log(logging.WARNING if slow or duplicates else logging.INFO, json.dumps(record, default=str))
+        return response
+
+
+def metrics_view(request):
+    """Serve the metrics to Prometheus, which must send METRICS_TOKEN; without a token set, nobody can"""
+    expected = f'Bearer {settings.METRICS_TOKEN}'.encode()
+    # In constant time, so the response time gives nothing away about the token
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(request.headers.get('Authorization', '').encode(), expected):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,137 @@
+import json
+import platform
+import subprocess
+import uuid
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+from core.benchmarking import cleanup, high_water_marks, routes, run_route
+from core.models import Budget, Category, Transaction
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measures query counts, latency percentiles and throughput of every API route and writes a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            default='bench_user_000001',
+            help='User the requests are made as (seed_data creates bench_user_000001 onwards)'
+        )
+        parser.add_argument('--password', type=str, default='benchmark', help='Password of that user, for /api/token/')
+        parser.add_argument('--requests', type=int, default=50, help='Requests sent to each route')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests sent to each route first')
+        parser.add_argument(
+            '--route',
+            action='append',
+            help='Route to benchmark, by name (repeatable, all by default)'
+        )
+        parser.add_argument(
+            '--cached',
+            action='store_true',
+            help='Let GET requests hit the response cache (by default each request misses it)'
+        )
+        parser.add_argument('--output', type=str, help='Path to write the JSON report to')
+        parser.add_argument('--compare', type=str, help='Earlier JSON report to print the differences against')
+
+    def handle(self, *args, **options):
+        username = options['username']
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'User {username} does not exist; create one with the seed_data command')
+
+        available = routes(user, options['password'])
+        if options['route']:
+            unknown = set(options['route']) - {route.name for route in available}
+            if unknown:
+                raise CommandError(f'Unknown route(s): {", ".join(sorted(unknown))}')
+            available = [route for route in available if route.name in options['route']]
+
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        nonce = None if options['cached'] else uuid.uuid4().hex[:8]
+        results = {}
+        marks = high_water_marks(user)
+        # The test client sends requests for the host "testserver"
+        with override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+            client = Client()
+            self.stdout.write(
+                f'{"route":<32}{"queries":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"req/s":>10}{"errors":>8}'
+            )
+            try:
+                for route in available:
+                    run_route(client, route, options['warmup'], headers, nonce and f'{nonce}-warmup')
+                    results[route.name] = run_route(client, route, options['requests'], headers, nonce)
+                    self.stdout.write(self.format_line(route.name, results[route.name]))
+            finally:
+                cleanup(user, marks)
+
+        report = {
+            'meta': {
+                'commit': git_commit(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'requests': options['requests'],
+                'cached': options['cached'],
+                'username': username,
+                'dataset': {
+                    'users': User.objects.count(),
+                    'categories': Category.objects.count(),
+                    'transactions': Transaction.objects.count(),
+                    'budgets': Budget.objects.count(),
+                    'user_transactions': Transaction.objects.filter(user=user).count(),
+                },
+            },
+            'routes': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Wrote the report to {options["output"]}'))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report)
+
+    def format_line(self, name, result):
+        latency = result['latency_ms']
+        return (
+            f'{name:<32}{result["queries"]["median"]:>8}{latency["p50"]:>10.1f}{latency["p95"]:>10.1f}'
+            f'{latency["p99"]:>10.1f}{result["throughput"] or 0:>10.1f}{result["errors"]:>8}'
+        )
+
+    def compare(self, baseline, report):
+        self.stdout.write(f'Compared with {baseline["meta"].get("commit") or "the baseline"}:')
+        self.stdout.write(f'{"route":<32}{"queries":>10}{"p50 ms":>16}{"p95 ms":>16}')
+        for name, result in report['routes'].items():
+            before = baseline['routes'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<32}{"new":>10}')
+                continue
+            queries = result['queries']['median'] - before['queries']['median']
+            columns = [f'{queries:>+10}']
+            for key in ('p50', 'p95'):
+                old, new = before['latency_ms'][key], result['latency_ms'][key]
+                change = (new - old) / old * 100 if old else 0
+                columns.append(f'{new - old:>+9.1f} ({change:>+4.0f}%)')
+            line = f'{name:<32}{"".join(columns)}'
+            # Extra queries are the regression that matters most
+            self.stdout.write(self.style.WARNING(line) if queries > 0 else line)
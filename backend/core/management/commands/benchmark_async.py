@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.benchmarking import percentile
+
+# (sync WSGI path, async ASGI path) of each endpoint
+ENDPOINTS = {
+    'dashboard': ('/api/dashboard/', '/api/async/dashboard/'),
+    'summary': ('/api/summary/', '/api/async/summary/'),
+    'current_month': ('/api/budgets/current_month/', '/api/async/budgets/current_month/'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compares sync (WSGI) and async (ASGI) throughput and latency of the read-heavy endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            required=True,
+            help='Username whose data the endpoints are read for'
+        )
+        parser.add_argument(
+            '--endpoint',
+            action='append',
+            choices=sorted(ENDPOINTS),
+            help='Endpoint to benchmark (repeatable, all by default)'
+        )
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and mode')
+        parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+        parser.add_argument(
+            '--cached',
+            action='store_true',
+            help='Keep the response cache on (by default every request reaches the database)'
+        )
+
+    def handle(self, *args, **options):
+        username = options['username']
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'User {username} does not exist')
+
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        self.requests = options['requests']
+        self.concurrency = options['concurrency']
+
+        # The in-process clients send requests for the host "testserver"
+        test_host = override_settings(ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver'])
+        no_cache = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+        self.stdout.write(f'{"endpoint":<16}{"mode":<8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        with test_host, nullcontext() if options['cached'] else no_cache:
+            for name in options.get('endpoint') or sorted(ENDPOINTS):
+                sync_path, async_path = ENDPOINTS[name]
+                self.report(name, 'wsgi', *self.run_sync(sync_path))
+                self.report(name, 'asgi', *asyncio.run(self.run_async(async_path)))
+
+    def report(self, name, mode, elapsed, results):
+        latencies = [latency for latency, _ in results]
+        errors = sum(1 for _, status_code in results if status_code != 200)
+        self.stdout.write(
+            f'{name:<16}{mode:<8}{len(results) / elapsed:>10.1f}'
+            f'{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}{errors:>8}'
+        )
+
+    def run_sync(self, path):
+        local = threading.local()
+
+        def fetch(_):
+            # Test clients are not thread-safe; each worker thread gets its own
+            if not hasattr(local, 'client'):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.get(path, headers=self.headers)
+            return time.perf_counter() - started, response.status_code
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(fetch, range(self.requests)))
+        return time.perf_counter() - started, results
+
+    async def run_async(self, path):
+        client = AsyncClient()
+        in_flight = asyncio.Semaphore(self.concurrency)
+
+        async def fetch():
+            async with in_flight:
+                started = time.perf_counter()
+                response = await client.get(path, headers=self.headers)
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[fetch() for _ in range(self.requests)])
+        return time.perf_counter() - started, results
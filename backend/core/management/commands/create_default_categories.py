@@ -1,8 +1,6 @@
-import os
-import django
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
-from core.models import Category
+from core.categories import provision_categories, provision_defaults
 
 class Command(BaseCommand):
     help = 'Creates default categories for all users or a specific user'
@@ -13,33 +11,14 @@ class Command(BaseCommand):
             type=str,
             help='Username to create default categories for (optional)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of users whose categories are inserted per statement'
+        )
 
     def handle(self, *args, **options):
-        # Default income categories
-        default_income_categories = [
-            'Salary',
-            'Freelance',
-            'Investments',
-            'Gifts',
-            'Other Income'
-        ]
-
-        # Default expense categories
-        default_expense_categories = [
-            'Housing',
-            'Food',
-            'Transportation',
-            'Utilities',
-            'Healthcare',
-            'Entertainment',
-            'Shopping',
-            'Education',
-            'Personal Care',
-            'Debt Payments',
-            'Savings',
-            'Other Expenses'
-        ]
-
         # Get username from options
         username = options.get('username')
 
@@ -47,55 +26,16 @@ class Command(BaseCommand):
         if username:
             try:
                 user = User.objects.get(username=username)
-                self._create_categories_for_user(user, default_income_categories, default_expense_categories)
+                provision_categories([user.id])
                 self.stdout.write(self.style.SUCCESS(f'Successfully created default categories for user {username}'))
             except User.DoesNotExist:
                 self.stdout.write(self.style.ERROR(f'User {username} does not exist'))
         else:
-            # Create categories for all users
-            users = User.objects.all()
-            for user in users:
-                self._create_categories_for_user(user, default_income_categories, default_expense_categories)
-            
-            # Also create default categories (not associated with any user)
-            self._create_default_categories(default_income_categories, default_expense_categories)
-            
-            self.stdout.write(self.style.SUCCESS('Successfully created default categories for all users'))
-
-    def _create_categories_for_user(self, user, income_categories, expense_categories):
-        # Create income categories
-        for category_name in income_categories:
-            Category.objects.get_or_create(
-                name=category_name,
-                type='income',
-                user=user,
-                defaults={'is_default': False}
-            )
+            # Create categories for all users, skipping the ones they already have
+            user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator()
+            count = provision_categories(user_ids, batch_size=options['batch_size'])
 
-        # Create expense categories
-        for category_name in expense_categories:
-            Category.objects.get_or_create(
-                name=category_name,
-                type='expense',
-                user=user,
-                defaults={'is_default': False}
-            )
-
-    def _create_default_categories(self, income_categories, expense_categories):
-        # Create default income categories (not associated with any user)
-        for category_name in income_categories:
-            Category.objects.get_or_create(
-                name=category_name,
-                type='income',
-                user=None,
-                defaults={'is_default': True}
-            )
+            # Also create default categories (not associated with any user)
+            provision_defaults()
 
-        # Create default expense categories (not associated with any user)
-        for category_name in expense_categories:
-            Category.objects.get_or_create(
-                name=category_name,
-                type='expense',
-                user=None,
-                defaults={'is_default': True}
-            )
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS(f'Successfully created default categories for all {count} users'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from core.deletion import CHUNK_SIZE, delete_user
+
+class Command(BaseCommand):
+    help = 'Deletes a user and all their data in chunks, or finishes an interrupted deletion'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'username',
+            type=str,
+            help='Username of the account to delete'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Number of rows deleted per database transaction'
+        )
+
+    def handle(self, *args, **options):
+        username = options['username']
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            self.stdout.write(self.style.ERROR(f'User {username} does not exist'))
+            return
+
+        delete_user(user, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted user {username}'))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from rest_framework import serializers
+from core.exports import EXPORT_FORMATS, check_format, export_chunks
+from core.serializers import ExportFiltersSerializer
+
+class Command(BaseCommand):
+    help = 'Exports a user\'s transactions to a CSV, JSON Lines or Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Path to write the export to')
+        parser.add_argument(
+            '--username',
+            type=str,
+            required=True,
+            help='Username to export the transactions of'
+        )
+        parser.add_argument(
+            '--format',
+            type=str,
+            choices=EXPORT_FORMATS,
+            help='File format (guessed from the file extension by default)'
+        )
+        parser.add_argument('--start-date', type=str, help='Only export transactions on or after this date')
+        parser.add_argument('--end-date', type=str, help='Only export transactions on or before this date')
+        parser.add_argument('--type', type=str, choices=('income', 'expense'), help='Only export this type')
+        parser.add_argument('--category', type=int, help='Only export this category id')
+
+    def handle(self, *args, **options):
+        username = options['username']
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'User {username} does not exist')
+
+        path = options['path']
+        extension = path.rsplit('.', 1)[-1].lower()
+        file_format = options.get('format') or (extension if extension in EXPORT_FORMATS else 'csv')
+        filters = ExportFiltersSerializer(data={
+            key: options[key] for key in ('start_date', 'end_date', 'type', 'category')
+            if options.get(key) is not None
+        })
+        try:
+            check_format(file_format)
+            filters.is_valid(raise_exception=True)
+        except serializers.ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        # Rows are written as they are read, never held whole
+        size = 0
+        with open(path, 'wb') as output:
+            for chunk in export_chunks(user, file_format, filters.data):
+                output.write(chunk)
+                size += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f'Exported transactions for {username} to {path} ({size} bytes)'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from core.importers import IMPORT_FORMATS, guess_format, import_transactions
+
+class Command(BaseCommand):
+    help = 'Imports transactions for a user from a CSV, OFX or QIF file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Path to the file to import')
+        parser.add_argument(
+            '--username',
+            type=str,
+            required=True,
+            help='Username to import the transactions for'
+        )
+        parser.add_argument(
+            '--format',
+            type=str,
+            choices=IMPORT_FORMATS,
+            help='File format (guessed from the file extension by default)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of rows to validate and insert per batch'
+        )
+
+    def handle(self, *args, **options):
+        username = options['username']
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'User {username} does not exist')
+
+        path = options['path']
+        file_format = options.get('format') or guess_format(path)
+        # The file is read line by line, never loaded whole
+        with open(path, encoding='utf-8-sig', newline='') as lines:
+            try:
+                result = import_transactions(user, lines, file_format, chunk_size=options['chunk_size'])
+            except UnicodeDecodeError:
+                raise CommandError(f'{path} is not UTF-8 encoded; nothing was imported')
+
+        for error in result['errors']:
+            self.stdout.write(self.style.WARNING(f"Row {error['row']}: {error['errors']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['created']} transactions for {username} "
+            f"({result['skipped']} already present, {result['error_count']} rejected)"
+        ))
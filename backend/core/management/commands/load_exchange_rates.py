@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from core.exchange_rates import read_rates, store_rates
+
+class Command(BaseCommand):
+    help = 'Loads daily exchange rates into the base currency from a CSV file with date, currency and rate columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Path to the CSV file to load')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rates to insert per query'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+                rates, errors = read_rates(lines)
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for line_number, message in errors:
+            self.stdout.write(self.style.WARNING(f'Line {line_number}: {message}'))
+        refreshed = store_rates(rates, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {len(rates)} {settings.BASE_CURRENCY} exchange rates '
+            f'({len(errors)} rejected, {refreshed} rollup months recomputed)'
+        ))
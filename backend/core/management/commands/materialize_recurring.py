@@ -0,0 +1,34 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from core.recurring import materialize_due
+
+class Command(BaseCommand):
+    help = 'Creates the transactions of every recurring rule that is due'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date',
+            type=str,
+            help='Materialize occurrences up to this date (YYYY-MM-DD, defaults to today)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rules to process per transaction'
+        )
+
+    def handle(self, *args, **options):
+        today = None
+        if options.get('date'):
+            try:
+                today = date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid date {options['date']}")
+
+        # Safe to run as often as needed; missed days are caught up without duplicates
+        rules, occurrences = materialize_due(today, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Materialized {occurrences} occurrences of {rules} recurring transactions'
+        ))
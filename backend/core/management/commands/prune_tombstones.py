@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.sync import prune_tombstones
+
+class Command(BaseCommand):
+    help = 'Deletes delta sync tombstones older than the oldest cursor still accepted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.SYNC_TOMBSTONE_DAYS,
+            help='Age in days past which tombstones are deleted (SYNC_TOMBSTONE_DAYS by default)'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} tombstones older than {options["days"]} days'))
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from core import rollups
+
+class Command(BaseCommand):
+    help = 'Rebuilds or verifies the monthly rollup totals for all users or a specific user'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            type=str,
+            help='Username to rebuild rollups for (optional)'
+        )
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Report buckets that disagree with the transactions instead of rebuilding'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of users to process per batch'
+        )
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+
+        # If username is provided, only process that user
+        username = options.get('username')
+        if username:
+            users = users.filter(username=username)
+            if not users.exists():
+                self.stdout.write(self.style.ERROR(f'User {username} does not exist'))
+                return
+
+        user_ids = list(users.values_list('id', flat=True))
+        batch_size = options['batch_size']
+        mismatches = 0
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            if options['verify']:
+                for bucket, stored, expected in rollups.verify(batch):
+                    mismatches += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'Mismatch for {bucket}: stored {stored}, expected {expected}'
+                    ))
+            else:
+                rollups.rebuild(batch)
+
+        if options['verify']:
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'Found {mismatches} mismatched rollup buckets'))
+            else:
+                self.stdout.write(self.style.SUCCESS('All rollup buckets match'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt rollups for {len(user_ids)} users'))
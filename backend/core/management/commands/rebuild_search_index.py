@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import router
+from core.models import Transaction
+from core.search import search_enabled, update_search_vectors
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored full-text search vector of every transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of transactions to update per statement'
+        )
+
+    def handle(self, *args, **options):
+        if not search_enabled(router.db_for_write(Transaction)):
+            self.stdout.write(self.style.WARNING('Full-text search is only available on PostgreSQL'))
+            return
+
+        # Walk the primary key in ranges so each UPDATE stays short
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(Transaction.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            update_search_vectors(Transaction.objects.filter(id__gte=ids[0], id__lte=ids[-1]))
+            updated += len(ids)
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Successfully rebuilt the search index for {updated} transactions'))
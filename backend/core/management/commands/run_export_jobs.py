@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.exports import claim_export_job, run_export_job
+
+class Command(BaseCommand):
+    help = 'Runs pending export jobs, optionally waiting for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep polling for new jobs instead of exiting when the queue is empty'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait between polls with --watch'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_export_job()
+            if job is None:
+                if not options['watch']:
+                    break
+                time.sleep(options['interval'])
+                continue
+
+            job = run_export_job(job)
+            if job.status == 'done':
+                self.stdout.write(self.style.SUCCESS(f'Export {job.pk} wrote {job.row_count} rows to {job.file.name}'))
+            else:
+                self.stdout.write(self.style.ERROR(f'Export {job.pk} failed: {job.error}'))
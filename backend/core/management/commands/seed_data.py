@@ -0,0 +1,151 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from core import rollups
+from core.categories import provision_categories, provision_defaults
+from core.models import Budget, Category, Transaction
+from core.search import update_search_vectors
+
+# Description words and amount ranges per category, loosely modelled on real statements
+EXPENSE_PROFILES = {
+    'Housing': (('Rent', 'Mortgage', 'Home insurance'), (600, 2500)),
+    'Food': (('Groceries', 'Coffee', 'Lunch', 'Dinner out', 'Bakery'), (3, 150)),
+    'Transportation': (('Fuel', 'Bus pass', 'Taxi', 'Parking', 'Train ticket'), (2, 120)),
+    'Utilities': (('Electricity', 'Water', 'Internet', 'Phone bill'), (20, 250)),
+    'Healthcare': (('Pharmacy', 'Dentist', 'Doctor visit'), (10, 400)),
+    'Entertainment': (('Cinema', 'Streaming', 'Concert', 'Books'), (5, 150)),
+    'Shopping': (('Clothes', 'Electronics', 'Gifts', 'Household'), (10, 600)),
+    'Education': (('Course fee', 'Books', 'Workshop'), (20, 800)),
+    'Personal Care': (('Haircut', 'Gym', 'Cosmetics'), (10, 120)),
+    'Debt Payments': (('Credit card', 'Loan payment'), (50, 900)),
+    'Savings': (('Savings transfer', 'Pension'), (50, 1000)),
+    'Other Expenses': (('Misc', 'Fees', 'Donation'), (1, 300)),
+}
+INCOME_PROFILES = {
+    'Salary': (('Monthly salary', 'Payroll'), (1500, 6000)),
+    'Freelance': (('Client invoice', 'Consulting'), (100, 3000)),
+    'Investments': (('Dividends', 'Interest'), (5, 800)),
+    'Gifts': (('Birthday gift',), (20, 300)),
+    'Other Income': (('Refund', 'Cashback'), (5, 200)),
+}
+USERNAME_PREFIX = 'bench_user_'
+
+
+class Command(BaseCommand):
+    help = 'Generates a reproducible dataset of users, categories, transactions and budgets for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create')
+        parser.add_argument(
+            '--transactions-per-user',
+            type=int,
+            default=1000,
+            help='Transactions created for each user'
+        )
+        parser.add_argument('--months', type=int, default=24, help='Months of history to spread transactions over')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs produce the same data')
+        parser.add_argument('--password', type=str, default='benchmark', help='Password of every generated user')
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of rows inserted per statement'
+        )
+
+    def handle(self, *args, **options):
+        randomizer = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        today = timezone.now().date()
+        start = today - timedelta(days=31 * options['months'])
+
+        # Every user shares one precomputed password hash; hashing per user would dominate
+        password = make_password(options['password'])
+        existing = set(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('username', flat=True))
+        users = [
+            User(username=f'{USERNAME_PREFIX}{number:06d}', email=f'{USERNAME_PREFIX}{number:06d}@example.com',
+                 password=password)
+            for number in range(1, options['users'] + 1)
+            if f'{USERNAME_PREFIX}{number:06d}' not in existing
+        ]
+        User.objects.bulk_create(users, batch_size=batch_size)
+        user_ids = list(User.objects.filter(
+            username__in=[user.username for user in users]
+        ).order_by('id').values_list('id', flat=True))
+
+        provision_defaults()
+        provision_categories(user_ids, batch_size=max(1, batch_size // 20))
+
+        created = 0
+        user_ids_iter = iter(user_ids)
+        while True:
+            chunk = list(islice(user_ids_iter, max(1, batch_size // max(1, options['transactions_per_user']))))
+            if not chunk:
+                break
+            with transaction.atomic():
+                created += self.seed_users(chunk, randomizer, start, today, options, batch_size)
+            self.stdout.write(f'Seeded {created} transactions')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(user_ids)} users and {created} transactions "
+            f"(password '{options['password']}')"
+        ))
+
+    def seed_users(self, user_ids, randomizer, start, today, options, batch_size):
+        categories = {}
+        for category_id, user_id, name, category_type in Category.objects.filter(
+            user_id__in=user_ids
+        ).values_list('id', 'user_id', 'name', 'type'):
+            categories.setdefault(user_id, []).append((category_id, name, category_type))
+
+        days = (today - start).days
+        rows = []
+        budgets = []
+        for user_id in user_ids:
+            own = categories.get(user_id, [])
+            expenses = [category for category in own if category[2] == 'expense']
+            incomes = [category for category in own if category[2] == 'income']
+            for _ in range(options['transactions_per_user']):
+                # Roughly one in eight transactions is income
+                if randomizer.random() < 0.125:
+                    pool, profiles = incomes, INCOME_PROFILES
+                else:
+                    pool, profiles = expenses, EXPENSE_PROFILES
+                category_id, name, category_type = randomizer.choice(pool)
+                words, (low, high) = profiles.get(name, (('Payment',), (1, 100)))
+                rows.append(Transaction(
+                    user_id=user_id,
+                    category_id=category_id,
+                    type=category_type,
+                    amount=Decimal(randomizer.randint(low * 100, high * 100)) / 100,
+                    description=randomizer.choice(words),
+                    date=start + timedelta(days=randomizer.randint(0, days))
+                ))
+
+            # Budgets for a few expense categories in each month of the history
+            for category_id, name, _ in randomizer.sample(expenses, min(4, len(expenses))):
+                low, high = EXPENSE_PROFILES.get(name, ((), (1, 100)))[1]
+                month = start.replace(day=1)
+                while month <= today:
+                    budgets.append(Budget(
+                        user_id=user_id,
+                        category_id=category_id,
+                        amount=Decimal(randomizer.randint(high * 50, high * 300)),
+                        month=month.month,
+                        year=month.year
+                    ))
+                    month = (month + timedelta(days=32)).replace(day=1)
+
+        Transaction.objects.bulk_create(rows, batch_size=batch_size)
+        Budget.objects.bulk_create(budgets, batch_size=batch_size, ignore_conflicts=True)
+
+        # Bulk inserts skip the signals that keep rollups and search vectors current
+        rollups.rebuild(user_ids)
+        update_search_vectors(Transaction.objects.filter(user_id__in=user_ids))
+        return len(rows)
@@ -1,7 +1,21 @@
+from datetime import datetime, time, timedelta
+import uuid
+
+from dateutil.rrule import rrulestr
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
 from django.db import models
+from django.db.models.functions import Coalesce, Round
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.utils import timezone
 
+from .utils import month_range
+
+def default_currency():
+    return settings.BASE_CURRENCY
+
 class Category(models.Model):
     CATEGORY_TYPES = (
         ('income', 'Income'),
@@ -12,14 +26,47 @@ class Category(models.Model):
     type = models.CharField(max_length=10, choices=CATEGORY_TYPES)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     is_default = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         verbose_name_plural = 'Categories'
         unique_together = ('name', 'user', 'type')
+        indexes = [
+            # Delta sync reads a user's changes since a cursor
+            models.Index(fields=['user', 'updated_at', 'id'], name='category_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.get_type_display()})"
 
+class TransactionQuerySet(models.QuerySet):
+    def in_month(self, month, year):
+        """Filter to a month with a plain date range the date indexes can serve"""
+        start, end = month_range(month, year)
+        return self.filter(date__gte=start, date__lt=end)
+    
+    def filter_params(self, params):
+        """Apply the start_date/end_date, type and category filters of a listing's query parameters"""
+        queryset = self
+        
+        # Filter by date range if provided
+        start_date = params.get('start_date')
+        end_date = params.get('end_date')
+        if start_date and end_date:
+            queryset = queryset.filter(date__range=[start_date, end_date])
+        
+        # Filter by transaction type if provided
+        transaction_type = params.get('type')
+        if transaction_type in ['income', 'expense']:
+            queryset = queryset.filter(type=transaction_type)
+        
+        # Filter by category if provided
+        category_id = params.get('category')
+        if category_id:
+            queryset = queryset.filter(category_id=category_id)
+        
+        return queryset
+
 class Transaction(models.Model):
     TRANSACTION_TYPES = (
         ('income', 'Income'),
@@ -28,44 +75,112 @@ class Transaction(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='transactions')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default=default_currency)  # ISO 4217 code
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='transactions')
     description = models.TextField(blank=True, null=True)
     date = models.DateField(default=timezone.now)
     type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
+    import_hash = models.CharField(max_length=64, null=True, blank=True, editable=False)  # Set by bulk imports
+    search_vector = SearchVectorField(null=True, editable=False)  # Kept in sync by core.search
+    recurring = models.ForeignKey(
+        'RecurringTransaction', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        related_name='transactions'
+    )  # Set on rows materialized from a recurring rule
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = TransactionQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-date', '-created_at']
+        ordering = ['-date', '-created_at', '-id']
+        indexes = [
+            # Listings, keyset pages and date ranges, newest first
+            models.Index(fields=['user', '-date', '-created_at', '-id'], name='transaction_user_date_idx'),
+            # Income/expense listings and monthly totals by type
+            models.Index(fields=['user', 'type', 'date'], name='transaction_user_type_date_idx'),
+            # Category filters and budget spending
+            models.Index(fields=['user', 'category', 'type', 'date'], name='transaction_user_cat_date_idx'),
+            # Full-text search over description and category name
+            GinIndex(fields=['search_vector'], name='transaction_search_idx'),
+            # Delta sync reads a user's changes since a cursor
+            models.Index(fields=['user', 'updated_at', 'id'], name='transaction_user_updated_idx'),
+        ]
+        constraints = [
+            # Re-importing the same file must not duplicate rows
+            models.UniqueConstraint(fields=['user', 'import_hash'], name='transaction_user_import_hash_uniq'),
+            # A recurring rule materializes each occurrence once
+            models.UniqueConstraint(fields=['recurring', 'date'], name='transaction_recurring_date_uniq'),
+        ]
     
     def __str__(self):
         return f"{self.amount} - {self.category} - {self.date}"
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so rollups can tell where an edited row came from
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+class BudgetQuerySet(models.QuerySet):
+    def with_spending(self):
+        """Annotate each budget with its month's expense total, in the budget's currency, in the same query"""
+        spent = MonthlyRollup.objects.filter(
+            user=models.OuterRef('user'),
+            category=models.OuterRef('category'),
+            type='expense',
+            month=models.OuterRef('month'),
+            year=models.OuterRef('year')
+        ).values('total')[:1]
+        spent = Coalesce(
+            models.Subquery(spent, output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            models.Value(0),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2)
+        )
+        # Rollups are in the base currency; other budgets take the rate in effect by the end of their month
+        rate = ExchangeRate.objects.month_rate(
+            models.OuterRef('currency'), models.OuterRef('year'), models.OuterRef('month')
+        )
+        return self.annotate(
+            spent_total=models.Case(
+                models.When(currency=settings.BASE_CURRENCY, then=spent),
+                default=Round(spent / rate, 2),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2)
+            )
+        )
 
 class Budget(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budgets')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='budgets')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default=default_currency)  # ISO 4217 code
     month = models.PositiveSmallIntegerField()  # 1-12 for Jan-Dec
     year = models.PositiveIntegerField()
+    alert_thresholds = models.JSONField(default=list, blank=True)  # percentages of amount, e.g. [80, 100]
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = BudgetQuerySet.as_manager()
+    
     class Meta:
         unique_together = ('user', 'category', 'month', 'year')
         ordering = ['-year', '-month']
+        indexes = [
+            # Month and year filters on a user's budgets
+            models.Index(fields=['user', 'year', 'month'], name='budget_user_period_idx'),
+            # Delta sync reads a user's changes since a cursor
+            models.Index(fields=['user', 'updated_at', 'id'], name='budget_user_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.category} - {self.amount} - {self.month}/{self.year}"
     
     def get_spent_amount(self):
         """Calculate how much has been spent in this budget category for the month"""
-        return Transaction.objects.filter(
-            user=self.user,
-            category=self.category,
-            type='expense',
-            date__month=self.month,
-            date__year=self.year
-        ).aggregate(total=models.Sum('amount'))['total'] or 0
+        # Use the total annotated by BudgetQuerySet.with_spending() when available
+        if hasattr(self, 'spent_total'):
+            return self.spent_total
+        return Budget.objects.with_spending().filter(pk=self.pk).values_list('spent_total', flat=True).first() or 0
     
     def get_remaining_amount(self):
         """Calculate remaining budget"""
@@ -77,4 +192,231 @@ class Budget(models.Model):
         spent = self.get_spent_amount()
         if self.amount > 0:
             return (spent / self.amount) * 100
-        return 0
\ No newline at end of file
+        return 0
+
+class MonthlyRollup(models.Model):
+    """Running per-user totals for one month, category and transaction type"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='monthly_rollups')
+    year = models.PositiveIntegerField()
+    month = models.PositiveSmallIntegerField()  # 1-12 for Jan-Dec
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, related_name='monthly_rollups')
+    type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # One bucket per user, month, category and type; NULLs never collide in a plain
+            # unique constraint, so uncategorized buckets need one of their own
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'category', 'type'],
+                condition=models.Q(category__isnull=False),
+                name='monthlyrollup_bucket_uniq'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'type'],
+                condition=models.Q(category__isnull=True),
+                name='monthlyrollup_uncategorized_uniq'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.category} - {self.type} - {self.month}/{self.year}"
+
+class ExchangeRateQuerySet(models.QuerySet):
+    def rate(self, currency, in_effect):
+        """
+        An expression for the rate of a currency: the newest rate matching in_effect, a Q over date.
+
+        Amounts older than every rate take the oldest one. A currency without
+        any rates is left unconverted; new transactions and budgets cannot use one.
+        """
+        rates = self.filter(currency=currency)
+        return Coalesce(
+            models.Subquery(rates.filter(in_effect).order_by('-date').values('rate')[:1]),
+            models.Subquery(rates.order_by('date').values('rate')[:1]),
+            models.Value(1),
+            output_field=models.DecimalField(max_digits=18, decimal_places=8)
+        )
+    
+    def month_rate(self, currency, year, month):
+        """The rate of a currency in effect by the end of a month, as budgets convert at"""
+        return self.rate(
+            currency,
+            models.Q(date__year__lt=year) | models.Q(date__year=year, date__month__lte=month)
+        )
+
+class ExchangeRate(models.Model):
+    """What one unit of a currency was worth in the base currency on a day"""
+    currency = models.CharField(max_length=3)  # ISO 4217 code
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+    
+    objects = ExchangeRateQuerySet.as_manager()
+    
+    class Meta:
+        constraints = [
+            # One rate per day; also serves the newest-rate-before-a-date lookups
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchangerate_currency_date_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+class BudgetAlert(models.Model):
+    """Records a budget's spending reaching one of its alert thresholds"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='budget_alerts')
+    budget = models.ForeignKey(Budget, on_delete=models.CASCADE, related_name='alerts')
+    threshold = models.PositiveSmallIntegerField()  # percentage of the budget amount
+    spent = models.DecimalField(max_digits=14, decimal_places=2)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at', '-id']
+        constraints = [
+            # A crossing is recorded once per budget and threshold
+            models.UniqueConstraint(fields=['budget', 'threshold'], name='budgetalert_budget_threshold_uniq'),
+        ]
+        indexes = [
+            # The alert feed reads a user's newest alerts
+            models.Index(fields=['user', 'created_at', 'id'], name='budgetalert_user_created_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.budget} - {self.threshold}% reached"
+
+def export_storage():
+    # Outside MEDIA_ROOT, so finished exports are only reachable through the download action
+    return FileSystemStorage(location=settings.EXPORT_ROOT, base_url=None)
+
+def export_path(instance, filename):
+    # A random directory per file, so one user's export path cannot be guessed from its time
+    return f'{uuid.uuid4().hex}/{filename}'
+
+class ExportJob(models.Model):
+    """A transaction export written to a file by the run_export_jobs worker"""
+    EXPORT_FORMATS = (
+        ('csv', 'CSV'),
+        ('ndjson', 'JSON Lines'),
+        ('parquet', 'Parquet'),
+    )
+    STATUSES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    file_format = models.CharField(max_length=10, choices=EXPORT_FORMATS)
+    filters = models.JSONField(default=dict, blank=True)  # start_date, end_date, type, category
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    file = models.FileField(upload_to=export_path, storage=export_storage, blank=True)
+    row_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # The worker's queue of pending jobs, oldest first
+            models.Index(fields=['status', 'created_at'], name='exportjob_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.file_format} export ({self.status})"
+
+class RecurringTransaction(models.Model):
+    """
+    A transaction repeated on the dates of an RFC 5545 recurrence rule.
+
+    next_run is the first occurrence not materialized yet, or None once the
+    rule has ended; the materialize_recurring command only looks at rules
+    that are due.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recurring_transactions')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='recurring_transactions')
+    description = models.TextField(blank=True, null=True)
+    type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES)
+    rule = models.CharField(max_length=500)  # e.g. FREQ=MONTHLY;BYMONTHDAY=1
+    start_date = models.DateField(default=timezone.now)
+    end_date = models.DateField(null=True, blank=True)
+    next_run = models.DateField(null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['next_run', 'id']
+        indexes = [
+            # The scheduler's scan for due rules; ended rules are left out
+            models.Index(
+                fields=['next_run'], name='recurring_next_run_idx', condition=models.Q(next_run__isnull=False)
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.amount} - {self.category} - {self.rule}"
+    
+    def save(self, *args, **kwargs):
+        # Editing a rule restarts it from the first occurrence not materialized yet
+        self.schedule()
+        super().save(*args, **kwargs)
+    
+    def get_rrule(self):
+        """Parse the rule, anchored at the start date"""
+        return rrulestr(self.rule, dtstart=datetime.combine(self.start_date, time.min))
+    
+    def next_occurrence(self, on_or_after):
+        """Return the first date of the rule on or after the given date, or None when it has ended"""
+        occurrence = self.get_rrule().after(datetime.combine(max(on_or_after, self.start_date), time.min), inc=True)
+        if occurrence is None or (self.end_date and occurrence.date() > self.end_date):
+            return None
+        return occurrence.date()
+    
+    def occurrences_through(self, day):
+        """Return the dates from next_run through the given day that have not been materialized"""
+        if self.next_run is None or self.next_run > day:
+            return []
+        if self.end_date:
+            day = min(day, self.end_date)
+        occurrences = self.get_rrule().between(
+            datetime.combine(self.next_run, time.min), datetime.combine(day, time.min), inc=True
+        )
+        # Sub-daily rules land on the same date more than once
+        return sorted({occurrence.date() for occurrence in occurrences})
+    
+    def schedule(self):
+        """Point next_run at the first occurrence after the newest materialized transaction"""
+        # The default start date is a datetime until it is saved
+        self.start_date = self._meta.get_field('start_date').to_python(self.start_date)
+        last_date = None
+        if self.pk:
+            last_date = self.transactions.aggregate(last_date=models.Max('date'))['last_date']
+        self.next_run = self.next_occurrence(last_date + timedelta(days=1) if last_date else self.start_date)
+
+class Tombstone(models.Model):
+    """Records a deleted transaction, budget or category so delta sync can report the deletion"""
+    MODELS = (
+        ('transaction', 'Transaction'),
+        ('budget', 'Budget'),
+        ('category', 'Category'),
+    )
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    model = models.CharField(max_length=20, choices=MODELS)
+    object_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            # Delta sync reads a user's deletions since a cursor; pruning scans by age
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_user_deleted_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user} - {self.model} {self.object_id} deleted {self.deleted_at}"
@@ -0,0 +1,180 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """Return the planner's row estimate for a queryset, or an exact count off Postgres"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class TransactionPagination(PageNumberPagination):
+    """
+    Page numbers by default, with keyset (cursor) pages on request.
+
+    Keyset pages walk the default -date, -created_at, -id ordering, so deep pages
+    cost the same as the first one. Page-number responses can skip the exact
+    total with ?count=none or use the planner's estimate with ?count=estimate.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+    count_modes = ('exact', 'estimate', 'none')
+    ordering = ('-date', '-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_page_size(request)
+        if not self.page_size_value:
+            return None
+
+        self.count_mode = request.query_params.get(self.count_query_param, 'exact')
+        if self.count_mode not in self.count_modes:
+            self.count_mode = 'exact'
+
+        # Keyset pages only make sense on the default ordering
+        use_cursor = (
+            self.cursor_query_param in request.query_params
+            or request.query_params.get(self.mode_query_param) == 'cursor'
+        )
+        if use_cursor and 'ordering' not in request.query_params:
+            self.use_cursor = True
+            return self.paginate_cursor(queryset, request)
+
+        self.use_cursor = False
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_without_count(queryset, request)
+
+    def paginate_cursor(self, queryset, request):
+        position, reverse = self.decode_cursor(request)
+        page_size = self.page_size_value
+        self.count = estimate_count(queryset) if self.count_mode == 'estimate' else None
+
+        if reverse:
+            queryset = queryset.order_by(*[field.lstrip('-') for field in self.ordering])
+            queryset = queryset.filter(self.position_filter(position, 'gt'))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if position is not None:
+                queryset = queryset.filter(self.position_filter(position, 'lt'))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.first_row = rows[0] if rows else None
+        self.last_row = rows[-1] if rows else None
+        return rows
+
+    def paginate_without_count(self, queryset, request):
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except (TypeError, ValueError):
+            self.page_number = 1
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=self.page_number, message='That page number is less than 1'
+            ))
+
+        page_size = self.page_size_value
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        self.has_previous = self.page_number > 1
+        self.count = estimate_count(queryset) if self.count_mode == 'estimate' else None
+        return rows[:page_size]
+
+    def position_filter(self, position, lookup):
+        date, created_at, pk = position
+        return (
+            Q(**{f'date__{lookup}': date})
+            | Q(date=date, **{f'created_at__{lookup}': created_at})
+            | Q(date=date, created_at=created_at, **{f'id__{lookup}': pk})
+        )
+
+    def encode_cursor(self, row, reverse):
+        # Rows are model instances, or values() rows on the fast listing path
+        if isinstance(row, dict):
+            date, created_at, pk = row['date'], row['created_at'], row['id']
+        else:
+            date, created_at, pk = row.date, row.created_at, row.pk
+        payload = {
+            'd': date.isoformat(),
+            'c': created_at.isoformat(),
+            'i': pk,
+            'r': reverse,
+        }
+        encoded = base64.urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = (parse_date(payload['d']), parse_datetime(payload['c']), int(payload['i']))
+            reverse = bool(payload.get('r', False))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_next_link(self):
+        if not self.use_cursor and self.count_mode == 'exact':
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        if self.use_cursor:
+            return self.encode_cursor(self.last_row, reverse=False) if self.last_row else None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if not self.use_cursor and self.count_mode == 'exact':
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        if self.use_cursor:
+            if self.first_row is None:
+                # Stepped past the end; start again from the newest rows
+                return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+            return self.encode_cursor(self.first_row, reverse=True)
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor and self.count_mode == 'exact':
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
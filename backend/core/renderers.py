@@ -0,0 +1,45 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import timed
+
+try:
+    import orjson
+except ImportError:  # Falls back to the json module
+    orjson = None
+
+# A number in exponent notation, which orjson and the json module spell differently
+EXPONENT = re.compile(rb'\d[eE][-+]?\d')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    DRF's compact JSON output, encoded with orjson when it is installed.
+
+    Types orjson would format differently (dates and times, Decimals) go
+    through DRF's encoder. Output that still differs from the json module's,
+    such as floats in exponent notation, is rendered again by JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('serialize'):
+            return self.encode(data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type, renderer_context):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            )
+        except (TypeError, orjson.JSONEncodeError):
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT.search(content):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Escaped like JSONRenderer does, so the output stays a strict JavaScript subset
+        return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
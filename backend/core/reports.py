@@ -0,0 +1,48 @@
+from django.conf import settings
+
+from . import rollups
+from .instrumentation import timed
+from .models import Budget, Transaction
+from .serializers import BudgetSerializer, TransactionListSerializer
+
+RECENT_TRANSACTIONS = 5
+
+
+def monthly_summary(user, month, year):
+    """A month's totals in the base currency, read from the rollup table with one query"""
+    income, expense = rollups.monthly_totals(user, month, year)
+    return {
+        'month': int(month),
+        'year': int(year),
+        'currency': settings.BASE_CURRENCY,
+        'total_income': income,
+        'total_expense': expense,
+        'remaining_balance': income - expense
+    }
+
+
+def recent_transactions(user):
+    """The user's newest transactions, with their categories joined in"""
+    return Transaction.objects.select_related('category').filter(
+        user=user
+    ).order_by('-date', '-created_at', '-id')[:RECENT_TRANSACTIONS]
+
+
+def month_budgets(user, month, year):
+    """A month's budgets, with spending worked out in the same query"""
+    return Budget.objects.with_spending().select_related('category').filter(
+        user=user,
+        month=month,
+        year=year
+    )
+
+
+def dashboard_data(summary, transactions, budgets):
+    """Assemble the dashboard from its parts, reading any querysets among them first"""
+    transactions, budgets = list(transactions), list(budgets)
+    with timed('serialize'):
+        return {
+            'summary': summary,
+            'recent_transactions': TransactionListSerializer(transactions, many=True).data,
+            'budgets': BudgetSerializer(budgets, many=True).data
+        }
@@ -0,0 +1,140 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from . import fx
+from .models import MonthlyRollup, Transaction
+
+ROLLUP_FIELDS = ('user_id', 'date', 'category_id', 'type', 'amount', 'currency')
+
+
+def bucket_for(values):
+    """Return the rollup bucket key for a dict of transaction values"""
+    return (
+        values['user_id'],
+        values['date'].year,
+        values['date'].month,
+        values['category_id'],
+        values['type'],
+    )
+
+
+def adjust(bucket, amount, count):
+    """Add an amount and a row count to a single rollup bucket, creating it if needed"""
+    user_id, year, month, category_id, transaction_type = bucket
+    buckets = MonthlyRollup.objects.filter(
+        user_id=user_id,
+        year=year,
+        month=month,
+        category_id=category_id,
+        type=transaction_type
+    )
+    if buckets.update(total=F('total') + amount, count=F('count') + count):
+        return
+    try:
+        with transaction.atomic():
+            MonthlyRollup.objects.create(
+                user_id=user_id,
+                year=year,
+                month=month,
+                category_id=category_id,
+                type=transaction_type,
+                total=amount,
+                count=count
+            )
+    except IntegrityError:
+        # Another writer created the bucket first
+        buckets.update(total=F('total') + amount, count=F('count') + count)
+
+
+def base_amount(values):
+    """A transaction's amount in the base currency, as the rollups hold it"""
+    return fx.to_base(values['amount'], values['currency'], values['date'])
+
+
+def record_change(old_values, new_values):
+    """Move a transaction's amount between buckets after a create, update or delete"""
+    if old_values == new_values:
+        return
+    if old_values is not None:
+        adjust(bucket_for(old_values), -base_amount(old_values), -1)
+    if new_values is not None:
+        adjust(bucket_for(new_values), base_amount(new_values), 1)
+
+
+def aggregate(queryset):
+    """Group a Transaction queryset into unsaved MonthlyRollup rows"""
+    rows = queryset.order_by().annotate(
+        rollup_year=ExtractYear('date'),
+        rollup_month=ExtractMonth('date')
+    ).values(
+        'user_id', 'rollup_year', 'rollup_month', 'category_id', 'type'
+    ).annotate(
+        rollup_total=Sum(fx.base_amount()),
+        rollup_count=Count('id')
+    )
+    return [
+        MonthlyRollup(
+            user_id=row['user_id'],
+            year=row['rollup_year'],
+            month=row['rollup_month'],
+            category_id=row['category_id'],
+            type=row['type'],
+            total=row['rollup_total'],
+            count=row['rollup_count']
+        )
+        for row in rows
+    ]
+
+
+def monthly_totals(user, month, year):
+    """Return a user's (income, expense) totals for a month from the rollup table"""
+    totals = MonthlyRollup.objects.filter(
+        user=user,
+        month=month,
+        year=year
+    ).aggregate(
+        income=Sum('total', filter=Q(type='income')),
+        expense=Sum('total', filter=Q(type='expense'))
+    )
+    return totals['income'] or 0, totals['expense'] or 0
+
+
+@transaction.atomic
+def refresh_months(user_id, months):
+    """Recompute the given (year, month) buckets of a user from their transactions"""
+    for year, month in set(months):
+        MonthlyRollup.objects.filter(user_id=user_id, year=year, month=month).delete()
+        MonthlyRollup.objects.bulk_create(aggregate(
+            Transaction.objects.filter(user_id=user_id).in_month(month, year)
+        ))
+
+
+@transaction.atomic
+def rebuild(user_ids):
+    """Recompute every bucket of the given users from scratch"""
+    MonthlyRollup.objects.filter(user_id__in=user_ids).delete()
+    MonthlyRollup.objects.bulk_create(
+        aggregate(Transaction.objects.filter(user_id__in=user_ids)),
+        batch_size=1000
+    )
+
+
+def verify(user_ids):
+    """Return (bucket, stored, expected) tuples for rollups that disagree with transactions"""
+    expected = {
+        (r.user_id, r.year, r.month, r.category_id, r.type): (r.total, r.count)
+        for r in aggregate(Transaction.objects.filter(user_id__in=user_ids))
+    }
+    stored = {
+        (r.user_id, r.year, r.month, r.category_id, r.type): (r.total, r.count)
+        for r in MonthlyRollup.objects.filter(user_id__in=user_ids)
+    }
+    mismatches = []
+    for bucket in expected.keys() | stored.keys():
+        # Emptied buckets are kept around with zero totals
+        stored_value = stored.get(bucket, (0, 0))
+        expected_value = expected.get(bucket, (0, 0))
+        if stored_value != expected_value:
+            mismatches.append((bucket, stored_value, expected_value))
+    return mismatches
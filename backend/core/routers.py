@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache import KEY_PREFIX
+
+REPLICA = 'replica'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def _pin_key(user_id):
+    return f'{KEY_PREFIX}:primary-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Keep a user's reads on the primary until the replica has caught up with their write"""
+    if replica_configured():
+        cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def replica_allowed(user_id):
+    """Whether a user's reads may go to the replica right now"""
+    return replica_configured() and not cache.get(_pin_key(user_id))
+
+
+@contextmanager
+def reading_from(replica):
+    """Route the reads made inside the block to the replica when replica is true"""
+    token = _use_replica.set(replica)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(handler):
+    """Serve a read-only view handler from the replica, unless its user has just written"""
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        with reading_from(replica_allowed(request.user.id)):
+            return handler(view, request, *args, **kwargs)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    """
+    Send reads to the replica inside reading_from(True), everything else to the primary.
+
+    Without a replica configured every query goes to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        if {obj1._state.db, obj2._state.db} <= {'default', REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
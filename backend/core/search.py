@@ -0,0 +1,57 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections, router
+from django.db.models import F, OuterRef, Subquery
+from rest_framework import filters
+
+from .models import Category, Transaction
+
+SEARCH_TERM = re.compile(r'\w+')
+
+
+def search_enabled(using):
+    """Full-text search needs Postgres; other databases fall back to substring matching"""
+    return connections[using].vendor == 'postgresql'
+
+
+def search_vector(with_category=True):
+    """The stored vector: description weighted above the category name"""
+    vector = SearchVector('description', weight='A', config=settings.SEARCH_CONFIG)
+    if with_category:
+        category_name = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+        vector += SearchVector(category_name, weight='B', config=settings.SEARCH_CONFIG)
+    return vector
+
+
+def update_search_vectors(queryset, with_category=True):
+    """Recompute the stored vector of every transaction in the queryset with one UPDATE"""
+    if search_enabled(router.db_for_write(Transaction)):
+        queryset.order_by().update(search_vector=search_vector(with_category))
+
+
+class TransactionSearchFilter(filters.SearchFilter):
+    """
+    Ranked prefix search over the stored search vector.
+
+    Off Postgres this is DRF's substring search over the view's search_fields.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if not search_enabled(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        terms = [word for term in self.get_search_terms(request) for word in SEARCH_TERM.findall(term)]
+        if not terms:
+            return queryset
+
+        # Every term must match, each as a prefix
+        query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=settings.SEARCH_CONFIG
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', *Transaction._meta.ordering)
@@ -1,7 +1,18 @@
+from collections import OrderedDict
+from decimal import Decimal
+from dateutil.rrule import rrulestr
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Sum
-from .models import Category, Transaction, Budget
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from .categories import provision_categories
+from .exports import check_format
+from .forecast import DEFAULT_WINDOW, DEFAULT_Z_THRESHOLD, MAX_WINDOW
+from .fx import check_currency
+from .models import Category, Transaction, Budget, BudgetAlert, ExportJob, RecurringTransaction
+from .recurring import SUB_DAILY_FREQUENCY
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -11,6 +22,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'password', 'first_name', 'last_name')
         extra_kwargs = {'password': {'write_only': True}}
     
+    @transaction.atomic
     def create(self, validated_data):
         user = User.objects.create_user(
             username=validated_data['username'],
@@ -19,26 +31,106 @@ class UserSerializer(serializers.ModelSerializer):
             first_name=validated_data.get('first_name', ''),
             last_name=validated_data.get('last_name', '')
         )
+        # New users start with their own copy of the default categories
+        provision_categories([user.id])
         return user
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ('id', 'name', 'type', 'is_default')
+        # Only the shared rows created by create_default_categories are defaults
+        read_only_fields = ('is_default',)
     
     def create(self, validated_data):
         # Set user from request context
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class CategoryMergeSerializer(serializers.Serializer):
+    """Validates merging the category in the context into a target category"""
+    target = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+    # Keep the emptied category instead of deleting it
+    delete = serializers.BooleanField(default=True)
+    
+    def validate_target(self, value):
+        user = self.context['request'].user
+        # The user's own categories and the shared defaults; any other ownerless row is not theirs
+        if value.user_id != user.id and not (value.user_id is None and value.is_default):
+            raise serializers.ValidationError(f'Invalid pk "{value.pk}" - object does not exist.')
+        if value.pk == self.context['category'].pk:
+            raise serializers.ValidationError('A category cannot be merged into itself.')
+        if value.type != self.context['category'].type:
+            raise serializers.ValidationError('Both categories must be of the same type.')
+        return value
+
 class TransactionSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     
     class Meta:
         model = Transaction
-        fields = ('id', 'amount', 'category', 'category_name', 'description', 'date', 'type', 'created_at')
+        fields = ('id', 'amount', 'currency', 'category', 'category_name', 'description', 'date', 'type', 'created_at')
         read_only_fields = ('created_at',)
     
+    def validate_currency(self, value):
+        return check_currency(value)
+    
+    def create(self, validated_data):
+        # Set user from request context
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
+class TransactionListSerializer(TransactionSerializer):
+    """Read-only transaction output for list responses; expects category to be joined"""
+    category = serializers.IntegerField(source='category_id', read_only=True)
+    
+    class Meta(TransactionSerializer.Meta):
+        read_only_fields = TransactionSerializer.Meta.fields
+
+class TransactionBatchItemSerializer(serializers.ModelSerializer):
+    """Validates one item of a batch against categories preloaded into the context"""
+    category = serializers.IntegerField(source='category_id', required=False, allow_null=True)
+    
+    class Meta:
+        model = Transaction
+        fields = ('amount', 'currency', 'category', 'description', 'date', 'type')
+    
+    def validate_currency(self, value):
+        return check_currency(value)
+    
+    def validate_category(self, value):
+        if value is not None and value not in self.context['categories']:
+            raise serializers.ValidationError(f'Invalid pk "{value}" - object does not exist.')
+        return value
+
+class RecurringTransactionSerializer(serializers.ModelSerializer):
+    category_name = serializers.CharField(source='category.name', read_only=True)
+    
+    class Meta:
+        model = RecurringTransaction
+        fields = ('id', 'amount', 'category', 'category_name', 'description', 'type', 'rule',
+                  'start_date', 'end_date', 'next_run', 'created_at')
+        read_only_fields = ('next_run', 'created_at')
+    
+    def validate_rule(self, value):
+        value = value.strip()
+        if value.upper().startswith('RRULE:'):
+            value = value[len('RRULE:'):]
+        if SUB_DAILY_FREQUENCY.search(value):
+            raise serializers.ValidationError('Rules cannot repeat more often than daily.')
+        try:
+            rrulestr(value)
+        except (ValueError, TypeError) as exc:
+            raise serializers.ValidationError(f'Invalid recurrence rule: {exc}')
+        return value
+    
+    def validate(self, data):
+        start_date = data.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = data.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError('end_date must not be before start_date.')
+        return data
+    
     def create(self, validated_data):
         # Set user from request context
         validated_data['user'] = self.context['request'].user
@@ -49,25 +141,156 @@ class BudgetSerializer(serializers.ModelSerializer):
     spent_amount = serializers.DecimalField(source='get_spent_amount', read_only=True, max_digits=10, decimal_places=2)
     remaining_amount = serializers.DecimalField(source='get_remaining_amount', read_only=True, max_digits=10, decimal_places=2)
     percentage_used = serializers.FloatField(source='get_percentage_used', read_only=True)
+    alert_thresholds = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=1000), max_length=10, required=False
+    )
     
     class Meta:
         model = Budget
-        fields = ('id', 'category', 'category_name', 'amount', 'month', 'year', 
-                 'spent_amount', 'remaining_amount', 'percentage_used')
+        fields = ('id', 'category', 'category_name', 'amount', 'currency', 'month', 'year', 
+                 'spent_amount', 'remaining_amount', 'percentage_used', 'alert_thresholds')
+    
+    def validate_currency(self, value):
+        return check_currency(value)
+    
+    def validate_alert_thresholds(self, value):
+        return sorted(set(value))
     
     def create(self, validated_data):
         # Set user from request context
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
-class MonthlySummarySerializer(serializers.Serializer):
-    month = serializers.IntegerField()
-    year = serializers.IntegerField()
-    total_income = serializers.DecimalField(max_digits=10, decimal_places=2)
-    total_expense = serializers.DecimalField(max_digits=10, decimal_places=2)
-    remaining_balance = serializers.DecimalField(max_digits=10, decimal_places=2)
+class BudgetAlertSerializer(serializers.ModelSerializer):
+    """An alert feed entry; expects the budget and its category to be joined"""
+    category = serializers.IntegerField(source='budget.category_id', read_only=True)
+    category_name = serializers.CharField(source='budget.category.name', read_only=True)
+    month = serializers.IntegerField(source='budget.month', read_only=True)
+    year = serializers.IntegerField(source='budget.year', read_only=True)
+    spent_amount = serializers.DecimalField(source='spent', read_only=True, max_digits=14, decimal_places=2)
+    budget_amount = serializers.DecimalField(source='amount', read_only=True, max_digits=10, decimal_places=2)
+    
+    class Meta:
+        model = BudgetAlert
+        fields = ('id', 'budget', 'category', 'category_name', 'month', 'year', 'threshold',
+                  'spent_amount', 'budget_amount', 'created_at')
+        read_only_fields = fields
+
+class PeriodSummarySerializer(serializers.Serializer):
+    total_income = serializers.DecimalField(max_digits=14, decimal_places=2)
+    total_expense = serializers.DecimalField(max_digits=14, decimal_places=2)
+    remaining_balance = serializers.DecimalField(max_digits=14, decimal_places=2)
+    
+    def get_fields(self):
+        # Fields describing the period itself come ahead of the totals
+        fields = super().get_fields()
+        totals = PeriodSummarySerializer._declared_fields
+        return OrderedDict(
+            [(name, field) for name, field in fields.items() if name not in totals]
+            + [(name, fields[name]) for name in totals]
+        )
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
-        data['remaining_balance'] = data['total_income'] - data['total_expense']
-        return data
\ No newline at end of file
+        # Decimal fields are rendered as strings, so subtract the parsed values
+        remaining = Decimal(data['total_income']) - Decimal(data['total_expense'])
+        data['remaining_balance'] = self.fields['remaining_balance'].to_representation(remaining)
+        return data
+
+class MonthlySummarySerializer(PeriodSummarySerializer):
+    """A period summary covering exactly one calendar month"""
+    month = serializers.IntegerField()
+    year = serializers.IntegerField()
+    currency = serializers.CharField()
+
+class CategoryAmountSerializer(serializers.Serializer):
+    category_id = serializers.IntegerField(allow_null=True)
+    category = serializers.CharField(allow_null=True)
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class AnalyticsPeriodSerializer(PeriodSummarySerializer):
+    period = serializers.DateField()
+    running_balance = serializers.DecimalField(max_digits=14, decimal_places=2)
+    income_by_category = CategoryAmountSerializer(many=True)
+    expenses_by_category = CategoryAmountSerializer(many=True)
+
+class AnalyticsQuerySerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    granularity = serializers.ChoiceField(choices=('day', 'week', 'month', 'year'), default='month')
+    
+    def validate(self, attrs):
+        # Default to the current year to date
+        today = timezone.now().date()
+        attrs.setdefault('end_date', today)
+        attrs.setdefault('start_date', attrs['end_date'].replace(month=1, day=1))
+        if attrs['start_date'] > attrs['end_date']:
+            raise serializers.ValidationError('start_date must not be after end_date.')
+        return attrs
+
+class ForecastQuerySerializer(serializers.Serializer):
+    window = serializers.IntegerField(min_value=7, max_value=MAX_WINDOW, default=DEFAULT_WINDOW)
+    threshold = serializers.FloatField(min_value=1, max_value=10, default=DEFAULT_Z_THRESHOLD)
+
+class CategoryForecastSerializer(serializers.Serializer):
+    category = serializers.IntegerField(allow_null=True)
+    category_name = serializers.CharField(allow_null=True)
+    month_to_date = serializers.DecimalField(max_digits=14, decimal_places=2)
+    moving_average = serializers.DecimalField(max_digits=14, decimal_places=2)
+    forecast = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class SpendingAnomalySerializer(serializers.Serializer):
+    date = serializers.DateField()
+    category = serializers.IntegerField(allow_null=True)
+    category_name = serializers.CharField(allow_null=True)
+    amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expected = serializers.DecimalField(max_digits=14, decimal_places=2)
+    z_score = serializers.FloatField()
+
+class ForecastSerializer(serializers.Serializer):
+    month = serializers.IntegerField()
+    year = serializers.IntegerField()
+    currency = serializers.CharField()
+    as_of = serializers.DateField()
+    window = serializers.IntegerField()
+    days_remaining = serializers.IntegerField()
+    month_to_date = serializers.DecimalField(max_digits=14, decimal_places=2)
+    forecast = serializers.DecimalField(max_digits=14, decimal_places=2)
+    categories = CategoryForecastSerializer(many=True)
+    anomalies = SpendingAnomalySerializer(many=True)
+
+class ExportFiltersSerializer(serializers.Serializer):
+    """The transaction listing filters an export accepts"""
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    type = serializers.ChoiceField(choices=Transaction.TRANSACTION_TYPES, required=False)
+    category = serializers.IntegerField(required=False)
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ExportJob
+        fields = ('id', 'file_format', 'filters', 'status', 'row_count', 'error',
+                  'created_at', 'started_at', 'finished_at', 'download_url')
+        read_only_fields = ('status', 'row_count', 'error', 'created_at', 'started_at', 'finished_at')
+    
+    def validate_file_format(self, value):
+        check_format(value)
+        return value
+    
+    def validate_filters(self, value):
+        filters = ExportFiltersSerializer(data=value)
+        filters.is_valid(raise_exception=True)
+        # Stored as JSON, so dates are kept in their ISO form
+        return filters.data
+    
+    def get_download_url(self, obj):
+        if obj.status != 'done':
+            return None
+        return reverse('export-download', args=[obj.pk], request=self.context.get('request'))
+    
+    def create(self, validated_data):
+        # Set user from request context
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
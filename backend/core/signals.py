@@ -0,0 +1,254 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.contrib.auth.models import User
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import alerts, authentication, cache, instrumentation, rollups, routers, search
+from .models import Budget, Category, MonthlyRollup, Tombstone, Transaction
+from .utils import month_range
+
+
+# Sent after set-based writes that skip the model signals, such as bulk_create.
+# Receivers get user_id and months, a set of the (year, month) pairs touched.
+transactions_changed = Signal()
+
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_rollups():
+    """Skip per-row rollup updates in the block; the caller sends transactions_changed after"""
+    _deferred.depth = getattr(_deferred, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _deferred.depth -= 1
+
+
+def _rollups_deferred():
+    return getattr(_deferred, 'depth', 0) > 0
+
+
+def _rollup_values(instance):
+    # Normalise through the model fields, e.g. a date given as a string or datetime
+    return {
+        field: Transaction._meta.get_field(field).to_python(getattr(instance, field))
+        for field in rollups.ROLLUP_FIELDS
+    }
+
+
+def _stored_values(instance):
+    loaded = getattr(instance, '_loaded_values', {})
+    if all(field in loaded for field in rollups.ROLLUP_FIELDS):
+        return {field: loaded[field] for field in rollups.ROLLUP_FIELDS}
+    return Transaction.objects.filter(pk=instance.pk).values(*rollups.ROLLUP_FIELDS).first()
+
+
+def _deleted_directly(origin, model):
+    # True when delete() was called on this model, not cascaded from a parent row
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_bucket(sender, instance, raw=False, **kwargs):
+    if raw or _rollups_deferred():
+        return
+    instance._rollup_previous = None if instance._state.adding else _stored_values(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    if raw or _rollups_deferred():
+        return
+    values = _rollup_values(instance)
+    rollups.record_change(instance._rollup_previous, values)
+    instance._loaded_values = values
+
+
+@receiver(post_delete, sender=Transaction)
+def update_rollup_on_delete(sender, instance, origin=None, **kwargs):
+    # Rollups of a deleted user or category are removed by the cascade
+    if _deleted_directly(origin, Transaction) and not _rollups_deferred():
+        rollups.record_change(_rollup_values(instance), None)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_months(sender, instance, origin=None, **kwargs):
+    instance._rollup_months = set(
+        MonthlyRollup.objects.filter(category=instance).values_list('user_id', 'year', 'month')
+    )
+
+
+@receiver(post_delete, sender=Category)
+def refresh_rollups_on_category_delete(sender, instance, origin=None, **kwargs):
+    # The category's transactions now sit in the uncategorized bucket
+    if not _deleted_directly(origin, Category):
+        return
+    months_by_user = {}
+    for user_id, year, month in instance._rollup_months:
+        months_by_user.setdefault(user_id, set()).add((year, month))
+    for user_id, months in months_by_user.items():
+        rollups.refresh_months(user_id, months)
+
+
+@receiver(transactions_changed)
+def refresh_rollups_on_bulk_change(sender, user_id, months, **kwargs):
+    rollups.refresh_months(user_id, months)
+
+
+# Alerts read the rollups, so these receivers come after the ones keeping them current
+@receiver(post_save, sender=Transaction)
+def check_budget_alerts_on_save(sender, instance, raw=False, **kwargs):
+    if raw or _rollups_deferred():
+        return
+    values = instance._loaded_values
+    if values['type'] == 'expense' and instance._rollup_previous != values:
+        alerts.check_bucket(*rollups.bucket_for(values)[:4])
+
+
+@receiver(transactions_changed)
+def check_budget_alerts_on_bulk_change(sender, user_id, months, **kwargs):
+    alerts.check_months(user_id, months)
+
+
+@receiver(post_save, sender=Budget)
+def check_budget_alerts_on_budget_save(sender, instance, raw=False, **kwargs):
+    # A new amount or new thresholds are evaluated afresh
+    if not raw:
+        alerts.evaluate(Budget.objects.filter(pk=instance.pk), reset=True)
+
+
+def _invalidate_on_commit(scopes):
+    # Bumped before the commit, a generation could be cached again from the old rows
+    transaction.on_commit(lambda: cache.invalidate(scopes))
+
+
+def _invalidate_transaction(instance):
+    dates = [Transaction._meta.get_field('date').to_python(instance.date)]
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        dates.append(previous['date'])
+    _invalidate_on_commit(cache.transaction_scopes(instance.user_id, [(day.year, day.month) for day in dates]))
+
+
+@receiver(post_save, sender=Transaction)
+def invalidate_cache_on_transaction_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidate_transaction(instance)
+
+
+@receiver(post_delete, sender=Transaction)
+def invalidate_cache_on_transaction_delete(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(origin, Transaction):
+        _invalidate_transaction(instance)
+
+
+@receiver(transactions_changed)
+def invalidate_cache_on_bulk_change(sender, user_id, months, **kwargs):
+    _invalidate_on_commit(cache.transaction_scopes(user_id, months))
+
+
+@receiver(pre_save, sender=Budget)
+def remember_budget_period(sender, instance, raw=False, **kwargs):
+    instance._previous_period = None
+    if not raw and not instance._state.adding:
+        instance._previous_period = Budget.objects.filter(pk=instance.pk).values_list('year', 'month').first()
+
+
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+def invalidate_cache_on_budget_change(sender, instance, **kwargs):
+    months = [(instance.year, instance.month)]
+    if getattr(instance, '_previous_period', None):
+        months.append(instance._previous_period)
+    _invalidate_on_commit(cache.transaction_scopes(instance.user_id, months))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cache_on_category_change(sender, instance, **kwargs):
+    _invalidate_on_commit(cache.category_scopes(instance))
+
+
+@receiver(post_save, sender=Transaction)
+def update_search_vector_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.update_search_vectors(Transaction.objects.filter(pk=instance.pk))
+
+
+@receiver(transactions_changed)
+def update_search_vectors_on_bulk_change(sender, user_id, months, **kwargs):
+    in_months = Q()
+    for year, month in months:
+        start, end = month_range(month, year)
+        in_months |= Q(date__gte=start, date__lt=end)
+    search.update_search_vectors(Transaction.objects.filter(in_months, user_id=user_id))
+
+
+@receiver(post_save, sender=Category)
+def update_search_vectors_on_category_rename(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        search.update_search_vectors(Transaction.objects.filter(category=instance))
+
+
+@receiver(pre_delete, sender=Category)
+def drop_category_from_search_vectors(sender, instance, origin=None, **kwargs):
+    # The transactions are about to lose this category
+    if _deleted_directly(origin, Category):
+        search.update_search_vectors(Transaction.objects.filter(category=instance), with_category=False)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Budget)
+@receiver(post_delete, sender=Budget)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def pin_writer_to_primary(sender, instance, **kwargs):
+    if instance.user_id is not None:
+        routers.pin_to_primary(instance.user_id)
+
+
+@receiver(transactions_changed)
+def pin_bulk_writer_to_primary(sender, user_id, **kwargs):
+    routers.pin_to_primary(user_id)
+
+
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=Budget)
+@receiver(post_delete, sender=Category)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    # Rows going with their user need no tombstone, and the shared defaults have no user to sync to
+    if instance.user_id is not None and not _deleted_directly(origin, User):
+        Tombstone.objects.create(user_id=instance.user_id, model=instance._meta.model_name, object_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def touch_transactions_of_deleted_category(sender, instance, origin=None, **kwargs):
+    # The cascade clears their category with an UPDATE that leaves updated_at alone
+    if _deleted_directly(origin, Category):
+        Transaction.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_authenticated_user(sender, instance, **kwargs):
+    # Password changes, deactivation and deletion must reach authentication at once, and
+    # again on commit in case a request cached the old row while the write was open
+    user_id = instance.pk
+    authentication.forget_user(user_id)
+    transaction.on_commit(lambda: authentication.forget_user(user_id))
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Sampled requests time their queries through the connection's execute wrapper
+    instrumentation.install_query_timer(connection)
@@ -0,0 +1,152 @@
+"""
+Delta sync of a user's categories, transactions and budgets.
+
+Each kind of row is a stream ordered by (updated_at, id), and deletions are a
+fourth stream of tombstones ordered by (deleted_at, id). The cursor holds the
+last position read in every stream, so a page picks up exactly where the
+previous one stopped.
+
+Rows written in the last SYNC_SETTLE_SECONDS are held back until the next
+page, so a write whose database transaction commits after a later one is not
+skipped over. That only holds for transactions that commit within
+SYNC_SETTLE_SECONDS of stamping updated_at: a longer-running writer, such as
+a file import, must stamp its rows again once it has committed.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+from .fastpath import BudgetValuesSerializer, CategoryValuesSerializer, TransactionValuesSerializer
+from .models import Budget, Category, Tombstone, Transaction
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 2000
+
+# Categories come first so rows never reference a category the client has not seen
+STREAMS = (
+    ('categories', 'category', Category, CategoryValuesSerializer),
+    ('transactions', 'transaction', Transaction, TransactionValuesSerializer),
+    ('budgets', 'budget', Budget, BudgetValuesSerializer),
+)
+
+
+class CursorExpired(APIException):
+    """The cursor is older than the tombstones kept, so deletions may have been missed"""
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The cursor has expired; download everything again without a cursor.'
+    default_code = 'cursor_expired'
+
+
+def encode_cursor(positions, issued_at):
+    payload = {
+        'p': {name: [moment.isoformat(), pk] if moment else None for name, (moment, pk) in positions.items()},
+        't': issued_at.isoformat(),
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+
+
+def decode_cursor(encoded):
+    """Return ({stream: (moment, id)}, issued_at) of a cursor"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        positions = {
+            name: (parse_datetime(position[0]), int(position[1])) if position else (None, 0)
+            for name, position in payload['p'].items()
+        }
+        issued_at = parse_datetime(payload['t'])
+    except (TypeError, ValueError, KeyError, IndexError, AttributeError):
+        raise NotFound('Invalid cursor')
+    names = {name for name, _, _, _ in STREAMS} | {'deleted'}
+    if set(positions) != names or issued_at is None or any(
+        moment is None and pk for moment, pk in positions.values()
+    ):
+        raise NotFound('Invalid cursor')
+    return positions, issued_at
+
+
+def page_size(value):
+    """The requested page size, bounded by MAX_PAGE_SIZE"""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        raise ValidationError({'limit': 'A valid integer is required.'})
+    if size < 1:
+        raise ValidationError({'limit': 'Ensure this value is greater than or equal to 1.'})
+    return min(size, MAX_PAGE_SIZE)
+
+
+def _after(field, position):
+    moment, pk = position
+    if moment is None:
+        return Q()
+    return Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'id__gt': pk})
+
+
+def _queryset(model, user):
+    if model is Budget:
+        return Budget.objects.with_spending().filter(user=user)
+    return model.objects.filter(user=user)
+
+
+def changes(user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return a page of the user's changes since the cursor, at most limit rows and tombstones.
+
+    Without a cursor the page starts a full download; deletions from before
+    it are irrelevant to the client and skipped.
+    """
+    now = timezone.now()
+    until = now - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+    if cursor:
+        positions, issued_at = decode_cursor(cursor)
+        if issued_at < now - timedelta(days=settings.SYNC_TOMBSTONE_DAYS):
+            raise CursorExpired()
+    else:
+        positions = {name: (None, 0) for name, _, _, _ in STREAMS}
+        positions['deleted'] = (until, 0)
+
+    data = {}
+    remaining = limit
+    has_more = False
+    for name, _, model, serializer_class in STREAMS:
+        queryset = _queryset(model, user).filter(_after('updated_at', positions[name]), updated_at__lte=until)
+        rows = list(serializer_class.values(queryset.order_by('updated_at', 'id'), 'updated_at')[:remaining + 1])
+        has_more = has_more or len(rows) > remaining
+        rows = rows[:remaining]
+        if rows:
+            positions[name] = (rows[-1]['updated_at'], rows[-1]['id'])
+        remaining -= len(rows)
+        data[name] = serializer_class(rows).data
+
+    deleted = {name: [] for name, _, _, _ in STREAMS}
+    streams = {model_name: name for name, model_name, _, _ in STREAMS}
+    tombstones = list(Tombstone.objects.filter(
+        _after('deleted_at', positions['deleted']), user=user, deleted_at__lte=until
+    ).order_by('deleted_at', 'id').values_list('model', 'object_id', 'deleted_at', 'id')[:remaining + 1])
+    has_more = has_more or len(tombstones) > remaining
+    tombstones = tombstones[:remaining]
+    for model_name, object_id, _, _ in tombstones:
+        deleted[streams[model_name]].append(object_id)
+    if tombstones:
+        positions['deleted'] = (tombstones[-1][2], tombstones[-1][3])
+    data['deleted'] = deleted
+
+    data['cursor'] = encode_cursor(positions, until)
+    data['has_more'] = has_more
+    return data
+
+
+def prune_tombstones(days=None):
+    """Delete tombstones older than any cursor still accepted, returning how many went"""
+    days = settings.SYNC_TOMBSTONE_DAYS if days is None else days
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
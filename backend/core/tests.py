@@ -0,0 +1,864 @@
+import base64
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import authentication, deletion, exchange_rates, fx, recurring, rollups, search, sync
+from .cache import exchange_rates_scope, generations, invalidate
+from .exports import claim_export_job, run_export_job
+from .forecast import build_forecast
+from .importers import TransactionImporter
+from .models import Budget, BudgetAlert, Category, ExchangeRate, ExportJob, MonthlyRollup, RecurringTransaction, Transaction
+from .serializers import BudgetSerializer, CategorySerializer, TransactionListSerializer
+
+
+class APITestCase(TestCase):
+    """A user with a few categories, transactions in two months and a budget"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='secret-password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.food = Category.objects.create(user=self.user, name='Food', type='expense')
+        self.salary = Category.objects.create(user=self.user, name='Salary', type='income')
+        self.add_transaction('1000.00', 'income', self.salary, date(2023, 11, 1))
+        for day in range(1, 6):
+            self.add_transaction('10.50', 'expense', self.food, date(2023, 11, day), f'Lunch {day}')
+            self.add_transaction('7.25', 'expense', self.food, date(2023, 10, day), f'Coffee {day}')
+        self.budget = Budget.objects.create(user=self.user, category=self.food, amount='100.00', month=11, year=2023)
+
+    def add_transaction(self, amount, transaction_type, category=None, day=date(2023, 11, 10), description=''):
+        return Transaction.objects.create(
+            user=self.user,
+            amount=Decimal(amount),
+            type=transaction_type,
+            category=category,
+            date=day,
+            description=description
+        )
+
+
+class MonthFilterTests(APITestCase):
+    def explain(self, queryset):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Small test tables are cheaper to scan; ask for the plan the index would give
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def test_in_month_is_a_date_range(self):
+        transactions = Transaction.objects.filter(user=self.user).in_month(11, 2023)
+        sql = str(transactions.query).lower()
+        self.assertNotIn('extract', sql)
+        self.assertEqual(transactions.count(), 6)
+        self.assertEqual(Transaction.objects.filter(user=self.user).in_month(12, 2023).count(), 0)
+
+    def test_month_filter_uses_a_user_date_index(self):
+        for transactions in (
+            Transaction.objects.filter(user=self.user).in_month(11, 2023),
+            Transaction.objects.filter(user=self.user, type='expense').in_month(11, 2023),
+        ):
+            plan = self.explain(transactions)
+            # Either index ranges over the month's dates within the user's rows
+            self.assertRegex(plan, r'transaction_user_(type_)?date_idx')
+
+    def test_budget_month_filter_uses_the_period_index(self):
+        plan = self.explain(Budget.objects.filter(user=self.user, year=2023, month=11))
+        self.assertIn('budget_user_period_idx', plan)
+
+    def test_monthly_summary_query_count(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/summary/?month=11&year=2023')
+        self.assertEqual(response.data['total_income'], '1000.00')
+        self.assertEqual(response.data['total_expense'], '52.50')
+
+        # More transactions in the month do not add queries
+        with self.captureOnCommitCallbacks(execute=True):
+            for day in range(6, 20):
+                self.add_transaction('1.00', 'expense', self.food, date(2023, 11, day))
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/summary/?month=11&year=2023')
+        self.assertEqual(response.data['total_expense'], '66.50')
+
+    def test_budget_spending_query_count(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.budget.get_spent_amount(), Decimal('52.50'))
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/budgets/?month=11&year=2023')
+        self.assertEqual(response.data['results'][0]['spent_amount'], '52.50')
+
+
+class CacheInvalidationTests(APITestCase):
+    def test_cached_responses_are_invalidated_when_the_write_commits(self):
+        self.assertEqual(self.client.get('/api/summary/?month=11&year=2023').data['total_expense'], '52.50')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.add_transaction('1.00', 'expense', self.food)
+            budget = Budget.objects.get(pk=self.budget.pk)
+            budget.amount = Decimal('90.00')
+            budget.save()
+            self.food.name = 'Groceries'
+            self.food.save()
+
+            # Until the commit, the response cached before the writes is still served
+            self.assertEqual(self.client.get('/api/summary/?month=11&year=2023').data['total_expense'], '52.50')
+        self.assertTrue(callbacks)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.client.get('/api/summary/?month=11&year=2023').data['total_expense'], '53.50')
+
+
+class ImportTests(APITestCase):
+    def upload(self, content):
+        return self.client.post('/api/transactions/import/', {
+            'file': SimpleUploadedFile('export.csv', content, content_type='text/csv'),
+        }, format='multipart')
+
+    def test_import(self):
+        lines = ['date,amount,description'] + [f'2023-07-{day:02d},-{day}.00,Row {day}' for day in range(1, 11)]
+        response = self.upload('\n'.join(lines).encode('utf-8'))
+        self.assertEqual(response.data['created'], 10)
+        self.assertEqual(self.client.get('/api/summary/?month=7&year=2023').data['total_expense'], '55.00')
+
+        # The same file again only skips rows
+        self.assertEqual(self.upload('\n'.join(lines).encode('utf-8')).data['skipped'], 10)
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+    def test_rows_dropped_as_conflicts_are_not_counted(self):
+        lines = ['date,amount'] + [f'2023-07-{day:02d},-1.00' for day in range(1, 6)]
+        self.assertEqual(self.upload('\n'.join(lines).encode('utf-8')).data['created'], 5)
+
+        # As if another import inserted the same rows after they were looked up
+        with mock.patch.object(TransactionImporter, 'existing_hashes', return_value=set()):
+            response = self.upload('\n'.join(lines + ['2023-07-06,-1.00']).encode('utf-8'))
+        self.assertEqual((response.data['created'], response.data['skipped']), (1, 5))
+        self.assertEqual(Transaction.objects.filter(user=self.user, date__month=7).count(), 6)
+
+    def test_row_with_more_fields_than_the_header(self):
+        content = b'date,amount\n2023-07-01,-1.00\n2023-07-02,-2.00,Lunch,extra\n2023-07-03,-3.00\n'
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [
+            {'row': 3, 'errors': {'non_field_errors': ['The row has more fields than the header.']}},
+        ])
+
+    def test_unreadable_file_imports_nothing(self):
+        # Bad bytes after more rows than one chunk holds
+        lines = ['date,amount'] + [f'2023-07-{day % 28 + 1:02d},-1.00' for day in range(600)]
+        content = '\n'.join(lines).encode('utf-8') + b'\n2023-07-01,-1.00,\xff\xfe\n'
+        response = self.upload(content)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Transaction.objects.filter(user=self.user, date__month=7).exists())
+        self.assertEqual(self.client.get('/api/summary/?month=7&year=2023').data['total_expense'], '0.00')
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+
+class BatchTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.lunches = list(Transaction.objects.filter(user=self.user, date__month=11, type='expense').order_by('date'))
+
+    def batch(self, payload):
+        return self.client.post('/api/transactions/bulk/', payload, format='json')
+
+    def state(self):
+        return sorted(Transaction.objects.filter(user=self.user).values_list('id', 'amount', 'description'))
+
+    def test_mixed_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.batch({
+                'create': [{'amount': '4.00', 'type': 'expense', 'date': '2023-11-20', 'category': self.food.id}],
+                'update': [{'id': self.lunches[0].id, 'amount': '12.00', 'description': 'Dinner'}],
+                'delete': [self.lunches[1].id],
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['create']), 1)
+        self.assertEqual(response.data['update'][0]['description'], 'Dinner')
+        self.assertEqual(response.data['delete'], [self.lunches[1].id])
+
+        self.assertEqual(Transaction.objects.get(pk=self.lunches[0].pk).amount, Decimal('12.00'))
+        self.assertFalse(Transaction.objects.filter(pk=self.lunches[1].pk).exists())
+        # 52.50 + 4.00 + 1.50 - 10.50
+        self.assertEqual(self.client.get('/api/summary/?month=11&year=2023').data['total_expense'], '47.50')
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+    def test_one_invalid_item_rejects_the_batch(self):
+        before = self.state()
+        other = User.objects.create_user('bob')
+        response = self.batch({
+            'create': [
+                {'amount': '4.00', 'type': 'expense', 'date': '2023-11-20'},
+                {'amount': 'lots', 'type': 'expense', 'date': '2023-11-20'},
+            ],
+            'update': [
+                {'id': self.lunches[0].id, 'description': 'Dinner'},
+                {'id': self.lunches[1].id, 'category': Category.objects.create(user=other, name='Bob', type='expense').id},
+            ],
+            'delete': [self.lunches[2].id, 0],
+        })
+        self.assertEqual(response.status_code, 400)
+        # Errors line up with the items they belong to
+        self.assertEqual(response.data['create'][0], {})
+        self.assertIn('amount', response.data['create'][1])
+        self.assertEqual(response.data['update'][0], {})
+        self.assertIn('category', response.data['update'][1])
+        self.assertEqual(response.data['delete'], [{}, {'id': ['Not found.']}])
+        self.assertEqual(self.state(), before)
+
+    def test_a_failing_write_rolls_back_the_batch(self):
+        before = self.state()
+        with mock.patch.object(Transaction.objects, 'bulk_update', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.batch({
+                    'create': [{'amount': '4.00', 'type': 'expense', 'date': '2023-11-20'}],
+                    'update': [{'id': self.lunches[0].id, 'description': 'Dinner'}],
+                })
+        self.assertEqual(self.state(), before)
+
+
+class SearchTests(APITestCase):
+    def search(self, terms):
+        response = self.client.get('/api/transactions/', {'search': terms})
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['description'] for row in response.data['results'])
+
+    def test_substring_search_off_postgres(self):
+        self.assertFalse(search.search_enabled(connection.alias))
+        self.assertEqual(self.search('LUNCH'), [f'Lunch {day}' for day in range(1, 6)])
+        self.assertEqual(self.search('unch 3'), ['Lunch 3'])
+        # The category name is searched as well
+        self.assertEqual(len(self.search('food')), 10)
+        self.assertEqual(self.search('rent'), [])
+
+
+class RecurringTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.rent = RecurringTransaction.objects.create(
+            user=self.user, amount='500.00', description='Rent', type='expense',
+            rule='FREQ=MONTHLY;BYMONTHDAY=1', start_date=date(2023, 1, 1)
+        )
+
+    def rent_dates(self):
+        return list(Transaction.objects.filter(recurring=self.rent).order_by('date').values_list('date', flat=True))
+
+    def test_materializing_twice(self):
+        self.assertEqual(recurring.materialize_due(date(2023, 6, 15)), (1, 6))
+        self.assertEqual(recurring.materialize_due(date(2023, 6, 15)), (0, 0))
+        self.assertEqual(self.rent_dates(), [date(2023, month, 1) for month in range(1, 7)])
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+    def test_saving_a_rule_after_materializing(self):
+        recurring.materialize_due(date(2023, 6, 15))
+        self.rent.refresh_from_db()
+        self.rent.description = 'Rent and parking'
+        self.rent.save()
+        self.assertEqual(self.rent.next_run, date(2023, 7, 1))
+
+        recurring.materialize_due(date(2023, 7, 15))
+        self.assertEqual(self.rent_dates(), [date(2023, month, 1) for month in range(1, 8)])
+
+    def test_occurrences_that_exist_are_not_written_again(self):
+        recurring.materialize_due(date(2023, 6, 15))
+        # As if a worker died after writing the rows but before advancing next_run
+        RecurringTransaction.objects.filter(pk=self.rent.pk).update(next_run=date(2023, 1, 1))
+        recurring.materialize_due(date(2023, 6, 15))
+        self.assertEqual(self.rent_dates(), [date(2023, month, 1) for month in range(1, 7)])
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+
+class BudgetAlertTests(APITestCase):
+    def alerts(self):
+        return list(BudgetAlert.objects.filter(budget=self.budget).order_by('threshold').values_list('threshold', flat=True))
+
+    def test_a_threshold_fires_once_a_month(self):
+        self.budget.alert_thresholds = [80, 100]
+        self.budget.save()
+        self.assertEqual(self.alerts(), [])
+
+        # 52.50 + 30.00 crosses 80%
+        self.add_transaction('30.00', 'expense', self.food)
+        self.assertEqual(self.alerts(), [80])
+
+        # Further spending in the month does not fire it again
+        self.add_transaction('1.00', 'expense', self.food)
+        self.add_transaction('2.00', 'expense', self.food, date(2023, 11, 11))
+        self.assertEqual(self.alerts(), [80])
+
+        self.add_transaction('20.00', 'expense', self.food)
+        self.assertEqual(self.alerts(), [80, 100])
+        self.add_transaction('5.00', 'expense', self.food)
+        self.assertEqual(self.alerts(), [80, 100])
+
+
+class ForecastTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.bob = User.objects.create_user('bob')
+        self.rent = Category.objects.create(user=self.bob, name='Rent', type='expense')
+
+    def spend(self, amounts, last_day):
+        """Spend the amounts on consecutive days up to last_day"""
+        first_day = last_day - timedelta(days=len(amounts) - 1)
+        Transaction.objects.bulk_create([
+            Transaction(user=self.bob, amount=amount, type='expense', category=self.rent,
+                        date=first_day + timedelta(days=offset))
+            for offset, amount in enumerate(amounts)
+        ])
+
+    def test_steady_spending(self):
+        self.spend([Decimal('10.00')] * 80, date(2023, 11, 20))
+        forecast = build_forecast(self.bob, date(2023, 11, 20), window=30)
+        self.assertEqual((forecast['days_remaining'], forecast['month_to_date']), (10, 200))
+        self.assertAlmostEqual(forecast['forecast'], 300)
+        [category] = forecast['categories']
+        self.assertEqual((category['category'], category['category_name']), (self.rent.id, 'Rent'))
+        self.assertAlmostEqual(category['moving_average'], 10)
+        self.assertEqual(forecast['anomalies'], [])
+
+    def test_unusual_day(self):
+        # 8.00 and 12.00 on alternate days, then 50.00 on the last one
+        self.spend([Decimal('8.00'), Decimal('12.00')] * 40 + [Decimal('50.00')], date(2023, 11, 20))
+        [anomaly] = build_forecast(self.bob, date(2023, 11, 20), window=30)['anomalies']
+        self.assertEqual((anomaly['date'], anomaly['category'], anomaly['amount']), (date(2023, 11, 20), self.rent.id, 50))
+        self.assertAlmostEqual(anomaly['expected'], 10)
+        self.assertEqual(anomaly['z_score'], 20)
+
+    def test_no_history(self):
+        forecast = build_forecast(self.bob, date(2023, 11, 20))
+        self.assertEqual((forecast['month_to_date'], forecast['forecast']), (0, 0))
+        self.assertEqual((forecast['categories'], forecast['anomalies']), ([], []))
+
+        self.client.force_authenticate(self.bob)
+        response = self.client.get('/api/forecast/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['forecast'], response.data['categories']), ('0.00', []))
+
+
+class KeysetPaginationTests(APITestCase):
+    def walk(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_rows_sharing_a_date(self):
+        for number in range(7):
+            self.add_transaction('1.00', 'expense', self.food, date(2023, 11, 5), f'Snack {number}')
+        # Some rows tie on created_at as well, leaving the id to order them
+        Transaction.objects.filter(user=self.user, description__startswith='Snack').update(created_at=timezone.now())
+
+        expected = list(Transaction.objects.filter(user=self.user).values_list('id', flat=True))
+        ids, pages = self.walk('/api/transactions/?pagination=cursor&page_size=3')
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 6)
+
+        # Stepping back from the third page returns the second
+        first = self.client.get('/api/transactions/?pagination=cursor&page_size=3')
+        second = self.client.get(first.data['next'])
+        third = self.client.get(second.data['next'])
+        back = self.client.get(third.data['previous'])
+        self.assertEqual([row['id'] for row in back.data['results']], expected[3:6])
+
+    def test_malformed_cursors(self):
+        for cursor in ('not a cursor', base64.urlsafe_b64encode(b'[]').decode(), base64.urlsafe_b64encode(
+            b'{"d": "yesterday", "c": "2023-11-01T00:00:00Z", "i": 1}'
+        ).decode()):
+            response = self.client.get('/api/transactions/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404, cursor)
+
+
+class DashboardQueryTests(APITestCase):
+    def assertDashboardQueries(self, budgets):
+        # Summary, recent transactions and budgets, however many of each there are
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['budgets']), budgets)
+        return response
+
+    def test_one_budget(self):
+        today = date.today()
+        self.add_transaction('20.00', 'expense', self.food, today)
+        Budget.objects.create(user=self.user, category=self.food, amount='50.00', month=today.month, year=today.year)
+        response = self.assertDashboardQueries(1)
+        self.assertEqual(response.data['budgets'][0]['spent_amount'], '20.00')
+        self.assertEqual(response.data['recent_transactions'][0]['category_name'], 'Food')
+
+    def test_many_budgets(self):
+        today = date.today()
+        for number in range(20):
+            category = Category.objects.create(user=self.user, name=f'Expense {number}', type='expense')
+            self.add_transaction('5.00', 'expense', category, today)
+            Budget.objects.create(user=self.user, category=category, amount='50.00', month=today.month, year=today.year)
+        response = self.assertDashboardQueries(20)
+        self.assertEqual(len(response.data['recent_transactions']), 5)
+        self.assertTrue(all(budget['spent_amount'] == '5.00' for budget in response.data['budgets']))
+
+
+class ListQueryTests(APITestCase):
+    """Every listing takes the same number of queries for one row as for a full page"""
+
+    # (url, queries); paginated listings count their rows in a query of their own
+    LISTINGS = (
+        ('/api/transactions/', 2),
+        ('/api/transactions/?page_size=50', 2),
+        ('/api/transactions/?count=none', 1),
+        ('/api/transactions/?pagination=cursor', 1),
+        ('/api/transactions/?ordering=category__name', 2),
+        ('/api/transactions/?search=lunch', 2),
+        ('/api/transactions/income/', 2),
+        ('/api/transactions/expense/', 2),
+        ('/api/budgets/', 2),
+        ('/api/budgets/?month=11&year=2023', 2),
+        ('/api/budgets/current_month/', 1),
+        # Category listings also reload the shared defaults, as the cache is cleared
+        ('/api/categories/', 2),
+        ('/api/categories/?search=e&ordering=-name', 2),
+        ('/api/categories/income/', 2),
+        ('/api/categories/expense/', 2),
+        ('/api/budget-alerts/', 2),
+        ('/api/recurring/', 2),
+        ('/api/exports/', 2),
+    )
+
+    def add_rows(self, count):
+        today = date.today()
+        for number in range(count):
+            category = Category.objects.create(user=self.user, name=f'Expense {number}', type='expense')
+            self.add_transaction('5.00', 'expense', category, today, f'Lunch {number}')
+            self.add_transaction('5.00', 'income', self.salary, today)
+            Budget.objects.create(
+                user=self.user, category=category, amount='10.00', month=today.month, year=today.year,
+                alert_thresholds=[50]
+            )
+            RecurringTransaction.objects.create(
+                user=self.user, amount='5.00', category=category, type='expense', rule='FREQ=MONTHLY'
+            )
+            ExportJob.objects.create(user=self.user, file_format='csv')
+
+    def assertListingQueries(self):
+        for url, queries in self.LISTINGS:
+            with self.subTest(url=url):
+                cache.clear()
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_one_row(self):
+        self.add_rows(1)
+        self.assertListingQueries()
+
+    def test_many_rows(self):
+        self.add_rows(30)
+        self.assertListingQueries()
+
+
+class ExportJobTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = mock.patch.object(ExportJob._meta.get_field('file'), 'storage', FileSystemStorage(directory.name))
+        storage.start()
+        self.addCleanup(storage.stop)
+
+    def test_export_is_served_to_its_owner_only(self):
+        job = run_export_job(ExportJob.objects.create(user=self.user, file_format='csv'))
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.row_count, 11)
+        # Stored under a random directory rather than a name built from the time alone
+        directory, filename = job.file.name.split('/')
+        self.assertRegex(directory, r'^[0-9a-f]{32}$')
+        self.assertTrue(filename.startswith('transactions-'))
+
+        response = self.client.get(f'/api/exports/{job.id}/download/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'filename="{filename}"', response['Content-Disposition'])
+        self.assertEqual(b''.join(response.streaming_content).decode().count('\n'), 12)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('bob', password='secret-password'))
+        self.assertEqual(other.get(f'/api/exports/{job.id}/download/').status_code, 404)
+
+    def test_jobs_whose_worker_died_are_claimed_again(self):
+        hour_ago = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT + 60)
+        lost = ExportJob.objects.create(user=self.user, file_format='csv', status='running', started_at=hour_ago)
+        ExportJob.objects.create(user=self.user, file_format='csv', status='running', started_at=timezone.now())
+
+        job = claim_export_job()
+        self.assertEqual((job.pk, job.status), (lost.pk, 'running'))
+        self.assertGreater(job.started_at, hour_ago)
+        self.assertIsNone(claim_export_job())
+
+    def test_a_reclaimed_job_is_finished_by_its_new_worker_only(self):
+        ExportJob.objects.create(user=self.user, file_format='csv')
+        slow = claim_export_job()
+        # Another worker claims the job again while the first one is still writing
+        ExportJob.objects.filter(pk=slow.pk).update(started_at=timezone.now() + timedelta(seconds=1))
+
+        slow = run_export_job(slow)
+        job = ExportJob.objects.get(pk=slow.pk)
+        self.assertEqual((job.status, job.file.name), ('running', ''))
+        self.assertEqual(slow.file.storage.listdir(''), ([], []))
+
+    def test_deleting_the_user_removes_export_files(self):
+        job = run_export_job(ExportJob.objects.create(user=self.user, file_format='csv'))
+        storage = job.file.storage
+        directory = job.file.name.split('/')[0]
+        self.assertTrue(storage.exists(job.file.name))
+
+        deletion.delete_user(self.user)
+        self.assertFalse(storage.exists(job.file.name))
+        self.assertFalse(storage.exists(directory))
+        self.assertFalse(ExportJob.objects.exists())
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        authentication._local_users.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.assertEqual(self.client.get('/api/categories/').status_code, 200)
+        self.assertIsNotNone(authentication.user_record(self.user.id))
+
+    def test_deactivated_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/categories/').status_code, 401)
+
+    def test_deleted_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/categories/').status_code, 401)
+
+
+class AsyncCacheTests(APITestCase):
+    def test_sync_and_async_views_share_etags_and_entries(self):
+        client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(self.user)}'})
+        for path, query in (('summary/', '?month=11&year=2023'), ('budgets/current_month/', '')):
+            with self.subTest(path=path):
+                sync = client.get(f'/api/{path}{query}')
+                self.assertEqual(sync.status_code, 200)
+
+                # The async view answers the sync view's ETag, and serves its entry without a query
+                not_modified = client.get(f'/api/async/{path}{query}', headers={'If-None-Match': sync['ETag']})
+                self.assertEqual(not_modified.status_code, 304)
+                with self.assertNumQueries(0):
+                    cached = client.get(f'/api/async/{path}{query}')
+                self.assertEqual(cached['ETag'], sync['ETag'])
+                self.assertEqual(cached.content, sync.content)
+
+
+class InstrumentationTests(APITestCase):
+    def test_sampled_listings_report_serialization_time(self):
+        with self.settings(INSTRUMENTATION_SAMPLE_RATE=1):
+            for url in ('/api/transactions/', '/api/categories/', '/api/budgets/', '/api/dashboard/'):
+                with self.subTest(url=url):
+                    self.assertIn('serialize;dur=', self.client.get(url)['Server-Timing'])
+
+    def test_metrics_need_a_token(self):
+        client = Client()
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_TOKEN='scrape-token'):
+            self.assertEqual(client.get('/metrics').status_code, 403)
+            self.assertEqual(client.get('/metrics', headers={'Authorization': 'Bearer scrape-tokén'}).status_code, 403)
+            response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'budgetscope_requests_total', response.content)
+
+
+class GoldenOutputTests(APITestCase):
+    """The values() fast path and the JSON renderer give the same bytes as the model serializers"""
+
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        trip = Category.objects.create(user=self.user, name='Caf\u00e9 \u2615 \u2028 "trips"', type='expense')
+        # No category and no description, and amounts that need their decimal places padded
+        self.add_transaction('5', 'expense', None, today, None)
+        self.add_transaction('0.10', 'expense', trip, today, '')
+        self.add_transaction('12345678.90', 'income', self.salary, today, 'Line\nbreak \u00fcml\u00e4ut')
+        # A budget spent past its amount, one with nothing spent and one of zero
+        Budget.objects.create(user=self.user, category=trip, amount='0.03', month=today.month, year=today.year)
+        Budget.objects.create(user=self.user, category=self.food, amount='3.00', month=today.month, year=today.year)
+        Budget.objects.create(user=self.user, category=self.salary, amount='0.00', month=today.month, year=today.year)
+
+    def assertSameAsModelSerializer(self, url, model, serializer_class):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        paginated = isinstance(response.data, dict)
+        rows = response.data['results'] if paginated else response.data
+        self.assertTrue(rows)
+
+        instances = model.objects.in_bulk([row['id'] for row in rows])
+        expected = serializer_class([instances[row['id']] for row in rows], many=True).data
+        if paginated:
+            expected = {**response.data, 'results': expected}
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_transaction_listings(self):
+        for url in (
+            '/api/transactions/', '/api/transactions/?page_size=100', '/api/transactions/?pagination=cursor',
+            '/api/transactions/?ordering=category__name', '/api/transactions/income/', '/api/transactions/expense/',
+        ):
+            with self.subTest(url=url):
+                self.assertSameAsModelSerializer(url, Transaction, TransactionListSerializer)
+
+    def test_category_listings(self):
+        for url in ('/api/categories/', '/api/categories/?ordering=-name', '/api/categories/income/', '/api/categories/expense/'):
+            with self.subTest(url=url):
+                self.assertSameAsModelSerializer(url, Category, CategorySerializer)
+
+    def test_budget_listings(self):
+        for url in ('/api/budgets/', '/api/budgets/current_month/'):
+            with self.subTest(url=url):
+                self.assertSameAsModelSerializer(url, Budget, BudgetSerializer)
+
+    def test_golden_rows(self):
+        uncategorized = Transaction.objects.get(user=self.user, category=None)
+        response = self.client.get('/api/transactions/expense/?page_size=100')
+        row = next(row for row in response.data['results'] if row['id'] == uncategorized.id)
+        # A missing category leaves out category_name rather than giving null
+        self.assertEqual(row, {
+            'id': uncategorized.id,
+            'amount': '5.00',
+            'currency': 'USD',
+            'category': None,
+            'description': None,
+            'date': date.today().isoformat(),
+            'type': 'expense',
+            'created_at': row['created_at'],
+        })
+
+        budgets = {row['category_name']: row for row in self.client.get('/api/budgets/current_month/').data}
+        self.assertEqual(budgets['Food']['spent_amount'], '0.00')
+        self.assertEqual(budgets['Food']['percentage_used'], 0.0)
+        self.assertEqual(budgets['Salary']['percentage_used'], 0)
+        self.assertEqual(budgets['Caf\u00e9 \u2615 \u2028 "trips"']['remaining_amount'], '-0.07')
+        self.assertIn(b'\\u2028', self.client.get('/api/categories/expense/').content)
+
+
+class CategoryMergeTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        ExchangeRate.objects.create(currency='EUR', date=date(2023, 1, 1), rate='1.10000000')
+        # Later than the budgets' month, so it must not be used
+        ExchangeRate.objects.create(currency='EUR', date=date(2023, 12, 1), rate='2.00000000')
+        fx.forget_rates()
+        self.dining = Category.objects.create(user=self.user, name='Dining', type='expense')
+        self.add_transaction('30.00', 'expense', self.dining, date(2023, 11, 3))
+
+    def merge(self, category, target):
+        response = self.client.post(f'/api/categories/{category.id}/merge/', {'target': target.id}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_merge_converts_budget_amounts(self):
+        # A EUR budget merged into the USD budget of the same month, and a USD one into a EUR budget
+        Budget.objects.create(user=self.user, category=self.dining, amount='50.00', currency='EUR', month=11, year=2023)
+        Budget.objects.create(user=self.user, category=self.dining, amount='55.00', month=10, year=2023)
+        october = Budget.objects.create(
+            user=self.user, category=self.food, amount='20.00', currency='EUR', month=10, year=2023
+        )
+        # In another month, so it only moves
+        december = Budget.objects.create(user=self.user, category=self.dining, amount='5.00', month=12, year=2023)
+
+        result = self.merge(self.dining, self.food)
+        self.assertEqual(result, {'transactions': 1, 'budgets': 1, 'budgets_merged': 2, 'recurring': 0})
+
+        self.budget.refresh_from_db()
+        october.refresh_from_db()
+        december.refresh_from_db()
+        self.assertEqual(self.budget.amount, Decimal('155.00'))
+        self.assertEqual(october.amount, Decimal('70.00'))
+        self.assertEqual((december.category_id, december.amount), (self.food.id, Decimal('5.00')))
+        self.assertFalse(Category.objects.filter(pk=self.dining.pk).exists())
+
+        november = self.client.get(f'/api/budgets/{self.budget.id}/').data
+        self.assertEqual(november['spent_amount'], '82.50')
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+    def test_merge_in_one_currency(self):
+        Budget.objects.create(user=self.user, category=self.dining, amount='40.25', month=11, year=2023)
+        self.merge(self.dining, self.food)
+        self.budget.refresh_from_db()
+        self.assertEqual(self.budget.amount, Decimal('140.25'))
+
+    def test_targets_the_user_cannot_see(self):
+        other = Category.objects.create(user=User.objects.create_user('bob'), name='Food', type='expense')
+        ownerless = Category.objects.create(user=None, name='Imported', type='expense', is_default=False)
+        shared = Category.objects.create(user=None, name='Meals', type='expense', is_default=True)
+        for target in (other, ownerless):
+            response = self.client.post(f'/api/categories/{self.dining.id}/merge/', {'target': target.id}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('target', response.data)
+        self.merge(self.dining, shared)
+
+
+class ExchangeRateCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        ExchangeRate.objects.create(currency='EUR', date=date(2023, 1, 1), rate='1.10000000')
+        fx.forget_rates()
+
+    def test_rates_are_read_again_after_another_process_stores_rates(self):
+        self.assertEqual(fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 1)), Decimal('11.00'))
+
+        # Another process stores a rate: the database and the shared generation change, not this process's memory
+        ExchangeRate.objects.filter(currency='EUR').update(rate='2.00000000')
+        self.assertEqual(fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 1)), Decimal('11.00'))
+        invalidate([exchange_rates_scope()])
+        self.assertEqual(fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 1)), Decimal('20.00'))
+
+    def test_rollups_kept_per_row_match_stored_rates(self):
+        self.client.post('/api/transactions/', {
+            'amount': '10.00', 'currency': 'EUR', 'category': self.food.id, 'date': '2023-11-20', 'type': 'expense'
+        }, format='json')
+        exchange_rates.store_rates([ExchangeRate(currency='EUR', date=date(2023, 11, 15), rate=Decimal('1.50'))])
+        self.client.post('/api/transactions/', {
+            'amount': '10.00', 'currency': 'EUR', 'category': self.food.id, 'date': '2023-11-21', 'type': 'expense'
+        }, format='json')
+        self.assertEqual(rollups.verify([self.user.id]), [])
+        self.assertEqual(self.client.get('/api/summary/?month=11&year=2023').data['total_expense'], '82.50')
+
+    def test_last_of_duplicate_rates_wins(self):
+        exchange_rates.store_rates([
+            ExchangeRate(currency='EUR', date=date(2023, 11, 15), rate=Decimal('1.50')),
+            ExchangeRate(currency='EUR', date=date(2023, 11, 15), rate=Decimal('1.60')),
+        ])
+        self.assertEqual(
+            list(ExchangeRate.objects.filter(currency='EUR', date=date(2023, 11, 15)).values_list('rate', flat=True)),
+            [Decimal('1.60000000')]
+        )
+
+    def test_other_processes_see_new_rates_after_the_commit(self):
+        before = generations([exchange_rates_scope()])
+        with self.captureOnCommitCallbacks(execute=True):
+            exchange_rates.store_rates([ExchangeRate(currency='EUR', date=date(2023, 11, 15), rate=Decimal('1.50'))])
+            self.assertEqual(generations([exchange_rates_scope()]), before)
+            # This process converts at the new rate at once
+            self.assertEqual(fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 20)), Decimal('15.00'))
+        self.assertNotEqual(generations([exchange_rates_scope()]), before)
+
+    def test_a_failed_store_changes_nothing(self):
+        Transaction.objects.create(
+            user=self.user, amount=Decimal('10.00'), currency='EUR', type='expense', category=self.food, date=date(2023, 11, 20)
+        )
+
+        def fail(user_id, months):
+            # After converting at the rate about to be rolled back
+            fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 20))
+            raise RuntimeError
+
+        with mock.patch.object(rollups, 'refresh_months', side_effect=fail), self.assertRaises(RuntimeError):
+            exchange_rates.store_rates([ExchangeRate(currency='EUR', date=date(2023, 11, 15), rate=Decimal('1.50'))])
+        self.assertFalse(ExchangeRate.objects.filter(date=date(2023, 11, 15)).exists())
+        self.assertEqual(fx.to_base(Decimal('10.00'), 'EUR', date(2023, 11, 20)), Decimal('11.00'))
+        self.assertEqual(rollups.verify([self.user.id]), [])
+
+
+class RollupTests(APITestCase):
+    def test_uncategorized_transactions_share_one_bucket(self):
+        self.add_transaction('5.00', 'expense')
+        self.add_transaction('6.00', 'expense')
+        buckets = MonthlyRollup.objects.filter(user=self.user, year=2023, month=11, category=None, type='expense')
+        self.assertEqual([(bucket.total, bucket.count) for bucket in buckets], [(Decimal('11.00'), 2)])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MonthlyRollup.objects.create(user=self.user, year=2023, month=11, category=None, type='expense')
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class SyncTests(APITestCase):
+    def sync(self, cursor=None, limit=sync.DEFAULT_PAGE_SIZE):
+        return sync.changes(self.user, cursor, limit)
+
+    def cursor_at(self, moment):
+        return sync.encode_cursor({name: (moment, 0) for name in ('categories', 'transactions', 'budgets', 'deleted')}, moment)
+
+    def test_cursor_round_trip(self):
+        issued_at = timezone.now()
+        positions = {'categories': (issued_at, 3), 'transactions': (None, 0), 'budgets': (issued_at, 1), 'deleted': (issued_at, 0)}
+        self.assertEqual(sync.decode_cursor(sync.encode_cursor(positions, issued_at)), (positions, issued_at))
+        self.assertEqual(self.client.get('/api/sync/', {'cursor': 'not-a-cursor'}).status_code, 404)
+
+    def test_expired_cursor(self):
+        cursor = self.cursor_at(timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_DAYS + 1))
+        response = self.client.get('/api/sync/', {'cursor': cursor})
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data['detail'].code, 'cursor_expired')
+
+    def test_pages_resume_where_the_last_one_stopped(self):
+        seen = []
+        cursor = None
+        while True:
+            page = self.sync(cursor, limit=4)
+            seen += [row['id'] for row in page['transactions']]
+            cursor = page['cursor']
+            if not page['has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(Transaction.objects.filter(user=self.user).values_list('id', flat=True)))
+
+        page = self.sync(cursor)
+        self.assertEqual((page['categories'], page['transactions'], page['budgets']), ([], [], []))
+
+    def test_changes_and_deletions_after_the_cursor(self):
+        cursor = self.sync()['cursor']
+        changed, deleted = Transaction.objects.filter(user=self.user, type='expense')[:2]
+        changed.description = 'Dinner'
+        changed.save()
+        deleted_id = deleted.id
+        deleted.delete()
+
+        page = self.sync(cursor)
+        self.assertEqual([row['description'] for row in page['transactions']], ['Dinner'])
+        self.assertEqual(page['deleted'], {'categories': [], 'transactions': [deleted_id], 'budgets': []})
+        self.assertEqual(self.sync(page['cursor'])['deleted']['transactions'], [])
+
+    def test_recent_writes_wait_for_the_settle_window(self):
+        with self.settings(SYNC_SETTLE_SECONDS=60):
+            page = self.sync()
+        self.assertEqual((page['transactions'], page['has_more']), ([], False))
+
+        # The rows held back arrive once they have settled
+        self.assertEqual(len(self.sync(page['cursor'])['transactions']), 11)
+
+    def test_rows_of_an_import_committed_after_the_cursor(self):
+        # An import stamped its rows an hour ago but commits only now, after a
+        # client synced while it was running
+        hour_ago = timezone.now() - timedelta(hours=1)
+        cursor = self.cursor_at(hour_ago + timedelta(minutes=30))
+        lines = ['date,amount,description'] + [f'2023-07-{day:02d},-{day}.00,Row {day}' for day in range(1, 4)]
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch('django.utils.timezone.now', return_value=hour_ago):
+                response = self.client.post('/api/transactions/import/', {
+                    'file': SimpleUploadedFile('export.csv', '\n'.join(lines).encode('utf-8'), content_type='text/csv'),
+                }, format='multipart')
+        self.assertEqual(response.data['created'], 3)
+
+        descriptions = {row['description'] for row in self.sync(cursor)['transactions']}
+        self.assertLessEqual({'Row 1', 'Row 2', 'Row 3'}, descriptions)
@@ -1,8 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     UserViewSet, CategoryViewSet, TransactionViewSet,
-    BudgetViewSet, MonthlySummaryView, DashboardView
+    BudgetViewSet, BudgetAlertViewSet, RecurringTransactionViewSet, ExportJobViewSet,
+    MonthlySummaryView, DashboardView, AnalyticsView, ForecastView, SyncView
 )
 
 # Create a router and register our viewsets with it
@@ -11,10 +13,20 @@ router.register(r'users', UserViewSet, basename='user')
 router.register(r'categories', CategoryViewSet, basename='category')
 router.register(r'transactions', TransactionViewSet, basename='transaction')
 router.register(r'budgets', BudgetViewSet, basename='budget')
+router.register(r'budget-alerts', BudgetAlertViewSet, basename='budget-alert')
+router.register(r'recurring', RecurringTransactionViewSet, basename='recurring')
+router.register(r'exports', ExportJobViewSet, basename='export')
 
 # The API URLs are determined automatically by the router
 urlpatterns = [
     path('', include(router.urls)),
     path('summary/', MonthlySummaryView.as_view(), name='monthly-summary'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('forecast/', ForecastView.as_view(), name='forecast'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    # Async variants of the read-heavy endpoints, for ASGI deployments
+    path('async/summary/', async_views.monthly_summary, name='async-monthly-summary'),
+    path('async/dashboard/', async_views.dashboard, name='async-dashboard'),
+    path('async/budgets/current_month/', async_views.current_month_budgets, name='async-budgets-current-month'),
 ]
\ No newline at end of file
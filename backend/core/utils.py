@@ -0,0 +1,11 @@
+from datetime import date
+
+
+def month_range(month, year):
+    """Return the half-open [start, end) date range covering a month"""
+    start = date(int(year), int(month), 1)
+    if start.month == 12:
+        end = date(start.year + 1, 1, 1)
+    else:
+        end = date(start.year, start.month + 1, 1)
+    return start, end
@@ -1,17 +1,36 @@
-from django.db.models import Sum, Q
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
 from django.contrib.auth.models import User
-from rest_framework import viewsets, permissions, status, filters
+from rest_framework import viewsets, mixins, permissions, serializers, status, filters
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from datetime import datetime
+import codecs
 
-from .models import Category, Transaction, Budget
+from . import deletion, reports, sync
+from .analytics import MAX_PERIODS, build_analytics, period_count
+from .cache import cache_response, categories_scope, period_scope, summary_scopes, user_scope
+from .batch import TransactionBatch, TransactionBatchSerializer
+from .categories import default_categories
+from .exports import CONTENT_TYPES, check_format, export_chunks, export_filename
+from .fastpath import BudgetValuesSerializer, CategoryValuesSerializer, FastListMixin, TransactionValuesSerializer
+from .forecast import build_forecast
+from .models import Category, Transaction, Budget, BudgetAlert, ExportJob, RecurringTransaction
 from .serializers import (
-    UserSerializer, CategorySerializer, TransactionSerializer,
-    BudgetSerializer, MonthlySummarySerializer
+    UserSerializer, CategorySerializer, CategoryMergeSerializer, TransactionSerializer,
+    TransactionListSerializer, BudgetSerializer, BudgetAlertSerializer, MonthlySummarySerializer,
+    AnalyticsPeriodSerializer, AnalyticsQuerySerializer, ExportFiltersSerializer, ExportJobSerializer,
+    ForecastQuerySerializer, ForecastSerializer, RecurringTransactionSerializer
 )
+from .importers import IMPORT_FORMATS, guess_format, import_transactions
+from .pagination import TransactionPagination
+from .routers import replica_reads
+from .search import TransactionSearchFilter
+from .utils import month_range
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -29,95 +48,197 @@ class UserViewSet(viewsets.ModelViewSet):
         if self.action == 'create':
             return [permissions.AllowAny()]
         return [permissions.IsAuthenticated()]
+    
+    def perform_destroy(self, instance):
+        # A long history is deleted in chunks rather than one cascade held in memory
+        deletion.delete_user(instance)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = CategorySerializer
+    fast_serializer_class = CategoryValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name']
     ordering_fields = ['name', 'type']
     
     def get_queryset(self):
-        # Return user's custom categories and default categories
+        # Listings merge in the cached defaults, so they only read the user's own rows
+        if self.action in ('list', 'income', 'expense'):
+            return Category.objects.filter(user=self.request.user)
+        # Detail routes can address the user's categories and the shared defaults
         return Category.objects.filter(
-            (Q(user=self.request.user) | Q(is_default=True))
-        ).distinct()
+            Q(user=self.request.user) | Q(user__isnull=True, is_default=True)
+        )
+    
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        categories = self.get_categories(self.filter_queryset(self.get_queryset()), filtered=True)
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            return self.get_paginated_response(self.fast_serializer_class(page).data)
+        return Response(self.fast_serializer_class(categories).data)
     
     @action(detail=False, methods=['get'])
     def income(self, request):
         # Filter categories by income type
-        queryset = self.get_queryset().filter(type='income')
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        categories = self.get_categories(self.get_queryset(), category_type='income')
+        return Response(self.fast_serializer_class(categories).data)
     
     @action(detail=False, methods=['get'])
     def expense(self, request):
         # Filter categories by expense type
-        queryset = self.get_queryset().filter(type='expense')
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        categories = self.get_categories(self.get_queryset(), category_type='expense')
+        return Response(self.fast_serializer_class(categories).data)
+    
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        # Move everything filed under this category to the target, merging budgets of the same month
+        category = self.get_object()
+        if category.user_id != request.user.id:
+            return Response(
+                {'detail': 'Shared default categories cannot be merged.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        payload = CategoryMergeSerializer(data=request.data, context={'request': request, 'category': category})
+        payload.is_valid(raise_exception=True)
+        result = deletion.merge_category(category, **payload.validated_data)
+        return Response(result)
+    
+    def perform_destroy(self, instance):
+        deletion.delete_category(instance)
+    
+    def get_categories(self, queryset, category_type=None, filtered=False):
+        """Return the shared defaults followed by the user's own rows, as values() rows searched and ordered alike"""
+        defaults = list(default_categories())
+        if category_type:
+            queryset = queryset.filter(type=category_type)
+            defaults = [category for category in defaults if category.type == category_type]
+        defaults = [
+            {field: getattr(category, field) for field in ('id', 'name', 'type', 'is_default')}
+            for category in defaults
+        ]
+        rows = list(self.fast_serializer_class.values(queryset))
+        if not filtered:
+            return sorted(defaults + rows, key=lambda category: category['id'])
+        
+        # Apply the search and ordering the filter backends gave the queryset to the defaults too
+        terms = [term.casefold() for term in filters.SearchFilter().get_search_terms(self.request)]
+        defaults = [
+            category for category in defaults
+            if all(term in category['name'].casefold() for term in terms)
+        ]
+        categories = sorted(defaults + rows, key=lambda category: category['id'])
+        ordering = filters.OrderingFilter().get_ordering(self.request, queryset, self) or []
+        for field in reversed(ordering):
+            name = field.lstrip('-')
+            categories.sort(key=lambda category: category[name].casefold(), reverse=field.startswith('-'))
+        return categories
 
 
-class TransactionViewSet(viewsets.ModelViewSet):
+class TransactionViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
+    fast_serializer_class = TransactionValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    pagination_class = TransactionPagination
+    filter_backends = [TransactionSearchFilter, filters.OrderingFilter]
     search_fields = ['description', 'category__name']
     ordering_fields = ['date', 'amount', 'category__name', 'type']
     
+    def get_serializer_class(self):
+        # Read-only listings skip the writable related fields
+        if self.action in ('list', 'income', 'expense'):
+            return TransactionListSerializer
+        return TransactionSerializer
+    
     def get_queryset(self):
-        # Return only user's transactions
-        queryset = Transaction.objects.filter(user=self.request.user)
-        
-        # Filter by date range if provided
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
-        if start_date and end_date:
-            queryset = queryset.filter(date__range=[start_date, end_date])
-        
-        # Filter by transaction type if provided
-        transaction_type = self.request.query_params.get('type')
-        if transaction_type in ['income', 'expense']:
-            queryset = queryset.filter(type=transaction_type)
-        
-        # Filter by category if provided
-        category_id = self.request.query_params.get('category')
-        if category_id:
-            queryset = queryset.filter(category_id=category_id)
-            
-        return queryset
+        # Return only user's transactions, with categories joined for category_name
+        # Narrowed by the start_date/end_date, type and category parameters
+        return Transaction.objects.select_related('category').defer('search_vector').filter(
+            user=self.request.user
+        ).filter_params(self.request.query_params)
+    
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        return self.fast_list(self.filter_queryset(self.get_queryset()))
     
     @action(detail=False, methods=['get'])
+    @replica_reads
     def income(self, request):
         # Filter transactions by income type
-        queryset = self.get_queryset().filter(type='income')
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.fast_list(self.get_queryset().filter(type='income'))
     
     @action(detail=False, methods=['get'])
+    @replica_reads
     def expense(self, request):
         # Filter transactions by expense type
-        queryset = self.get_queryset().filter(type='expense')
-        page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.fast_list(self.get_queryset().filter(type='expense'))
+    
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        # Apply a batch of creates, partial updates and deletes in one transaction
+        payload = TransactionBatchSerializer(data=request.data)
+        payload.is_valid(raise_exception=True)
+        batch = TransactionBatch(request.user, **payload.validated_data)
+        if not batch.is_valid():
+            return Response(batch.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        created, updated, deleted = batch.save()
+        return Response({
+            'create': TransactionListSerializer(created, many=True).data,
+            'update': TransactionListSerializer(updated, many=True).data,
+            'delete': deleted
+        })
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # Stream every matching transaction; large histories can use /api/exports/ instead
+        file_format = request.query_params.get('file_format', 'csv')
+        try:
+            check_format(file_format)
+        except serializers.ValidationError as exc:
+            return Response({'file_format': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Bad filters must fail before the first row is streamed
+        export_filters = ExportFiltersSerializer(data=request.query_params)
+        export_filters.is_valid(raise_exception=True)
+        
+        response = StreamingHttpResponse(
+            export_chunks(request.user, file_format, export_filters.data),
+            content_type=CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{export_filename(file_format)}"'
+        return response
+    
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        # Stream an uploaded CSV/OFX/QIF export into the user's transactions
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        file_format = request.data.get('file_format') or guess_format(upload.name)
+        if file_format not in IMPORT_FORMATS:
+            return Response(
+                {'file_format': [f'Must be one of: {", ".join(IMPORT_FORMATS)}.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            result = import_transactions(request.user, codecs.iterdecode(upload, 'utf-8-sig'), file_format)
+        except UnicodeDecodeError:
+            return Response({'file': ['The file must be UTF-8 encoded.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
 
 
-class BudgetViewSet(viewsets.ModelViewSet):
+class BudgetViewSet(FastListMixin, viewsets.ModelViewSet):
     serializer_class = BudgetSerializer
+    fast_serializer_class = BudgetValuesSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
-        # Return only user's budgets
-        queryset = Budget.objects.filter(user=self.request.user)
+        # Return only user's budgets, with spending worked out in the same query
+        queryset = Budget.objects.with_spending().select_related('category').filter(user=self.request.user)
         
         # Filter by month and year if provided
         month = self.request.query_params.get('month')
@@ -129,18 +250,86 @@ class BudgetViewSet(viewsets.ModelViewSet):
             
         return queryset
     
+    @replica_reads
+    def list(self, request, *args, **kwargs):
+        return self.fast_list(self.filter_queryset(self.get_queryset()))
+
+    def perform_update(self, serializer):
+        budget = serializer.save()
+        # The spending annotated when the budget was loaded is for its old category and month
+        budget.__dict__.pop('spent_total', None)
+
     @action(detail=False, methods=['get'])
+    @cache_response('budgets-current-month', lambda request: [
+        period_scope(request.user.id, timezone.now().year, timezone.now().month),
+        categories_scope(request.user.id),
+        categories_scope(None),
+    ])
+    @replica_reads
     def current_month(self, request):
         # Get current month's budgets
         today = timezone.now().date()
         queryset = self.get_queryset().filter(month=today.month, year=today.year)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return Response(self.fast_serializer_class(self.fast_serializer_class.values(queryset)).data)
+
+
+class BudgetAlertViewSet(viewsets.ReadOnlyModelViewSet):
+    """Budget thresholds reached, newest first; recorded as transactions are written"""
+    serializer_class = BudgetAlertSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = BudgetAlert.objects.select_related('budget__category').filter(user=self.request.user)
+        
+        # Clients polling the feed ask only for alerts newer than the last one they saw
+        after = self.request.query_params.get('after')
+        if after:
+            try:
+                queryset = queryset.filter(id__gt=int(after))
+            except ValueError:
+                raise serializers.ValidationError({'after': ['A valid integer is required.']})
+        return queryset
+
+
+class RecurringTransactionViewSet(viewsets.ModelViewSet):
+    """Recurring rules; their occurrences are created by the materialize_recurring command"""
+    serializer_class = RecurringTransactionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        # Return only user's recurring rules
+        return RecurringTransaction.objects.select_related('category').filter(user=self.request.user)
+
+
+class ExportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                       mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Background exports, written by the run_export_jobs worker"""
+    serializer_class = ExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        # Return only user's export jobs
+        return ExportJob.objects.filter(user=self.request.user)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        # Serve the finished file to its owner only
+        job = self.get_object()
+        if job.status != 'done' or not job.file:
+            raise Http404('This export is not ready.')
+        return FileResponse(
+            job.file.open('rb'),
+            as_attachment=True,
+            filename=job.file.name.rsplit('/', 1)[-1],
+            content_type=CONTENT_TYPES[job.file_format]
+        )
 
 
 class MonthlySummaryView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    @cache_response('monthly-summary', summary_scopes)
+    @replica_reads
     def get(self, request):
         # Get month and year from query params or use current month
         month = request.query_params.get('month')
@@ -151,79 +340,95 @@ class MonthlySummaryView(APIView):
             month = today.month
             year = today.year
         
-        # Calculate total income and expenses for the month
-        income = Transaction.objects.filter(
-            user=request.user,
-            type='income',
-            date__month=month,
-            date__year=year
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        expense = Transaction.objects.filter(
-            user=request.user,
-            type='expense',
-            date__month=month,
-            date__year=year
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Create summary data
-        summary = {
-            'month': int(month),
-            'year': int(year),
-            'total_income': income,
-            'total_expense': expense,
-            'remaining_balance': income - expense
-        }
+        try:
+            month_range(month, year)
+        except ValueError:
+            return Response({'detail': 'Invalid month or year.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer = MonthlySummarySerializer(summary)
+        # Read the month's totals from the rollup table
+        serializer = MonthlySummarySerializer(reports.monthly_summary(request.user, month, year))
         return Response(serializer.data)
 
 
 class DashboardView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    @cache_response('dashboard', lambda request: [user_scope(request.user.id), categories_scope(None)])
+    @replica_reads
     def get(self, request):
         # Get current date
         today = timezone.now().date()
         
-        # Get monthly summary
-        income = Transaction.objects.filter(
-            user=request.user,
-            type='income',
-            date__month=today.month,
-            date__year=today.year
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        # Monthly summary, recent transactions and budgets are one query each
+        data = reports.dashboard_data(
+            reports.monthly_summary(request.user, today.month, today.year),
+            reports.recent_transactions(request.user),
+            reports.month_budgets(request.user, today.month, today.year)
+        )
+        return Response(data)
+
+
+class AnalyticsView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    @cache_response('analytics', lambda request: [
+        user_scope(request.user.id),
+        categories_scope(request.user.id),
+        categories_scope(None),
+    ])
+    @replica_reads
+    def get(self, request):
+        # Validate the date range and granularity
+        params = AnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        start_date = params.validated_data['start_date']
+        end_date = params.validated_data['end_date']
+        granularity = params.validated_data['granularity']
         
-        expense = Transaction.objects.filter(
-            user=request.user,
-            type='expense',
-            date__month=today.month,
-            date__year=today.year
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        if period_count(start_date, end_date, granularity) > MAX_PERIODS:
+            return Response(
+                {'detail': f'The range spans more than {MAX_PERIODS} periods; use a coarser granularity.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Get recent transactions
-        recent_transactions = Transaction.objects.filter(
-            user=request.user
-        ).order_by('-date', '-created_at')[:5]
+        # All periods come out of a single grouped query
+        periods = build_analytics(request.user, start_date, end_date, granularity)
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'granularity': granularity,
+            'currency': settings.BASE_CURRENCY,
+            'periods': AnalyticsPeriodSerializer(periods, many=True).data
+        })
+
+
+class ForecastView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    @cache_response('forecast', lambda request: [
+        user_scope(request.user.id),
+        categories_scope(request.user.id),
+        categories_scope(None),
+    ])
+    @replica_reads
+    def get(self, request):
+        params = ForecastQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
         
-        # Get budgets for current month
-        budgets = Budget.objects.filter(
-            user=request.user,
-            month=today.month,
-            year=today.year
+        # Reads a fixed window of daily totals, however long the user's history
+        forecast = build_forecast(
+            request.user,
+            timezone.now().date(),
+            params.validated_data['window'],
+            params.validated_data['threshold']
         )
-        
-        # Prepare response data
-        data = {
-            'summary': {
-                'month': today.month,
-                'year': today.year,
-                'total_income': income,
-                'total_expense': expense,
-                'remaining_balance': income - expense
-            },
-            'recent_transactions': TransactionSerializer(recent_transactions, many=True).data,
-            'budgets': BudgetSerializer(budgets, many=True).data
-        }
-        
-        return Response(data)
\ No newline at end of file
+        return Response(ForecastSerializer(forecast).data)
+
+
+class SyncView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get(self, request):
+        # Reads stay on the primary; a lagging replica could let the cursor pass rows it has not seen yet
+        limit = sync.page_size(request.query_params.get('limit'))
+        return Response(sync.changes(request.user, request.query_params.get('cursor'), limit))